@@ -0,0 +1,382 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.utils import resample
+
+from smote import SMOTE
+from sampling import generate_samples_batched, generate_samples_conditional, delete_samples
+
+logger = logging.getLogger(__name__)
+
+
+def RUS_balance(dataset_orig, random_state=123):
+    if dataset_orig.empty:
+        return dataset_orig
+    # print('imbalanced data:\n', dataset_orig['action_taken'].value_counts())
+    action_df = dataset_orig['action_taken'].value_counts()
+    maj_label = action_df.index[0]
+    min_label = action_df.index[-1]
+    if maj_label == min_label:
+        return dataset_orig
+    df_majority = dataset_orig[dataset_orig.action_taken == maj_label]
+    df_minority = dataset_orig[dataset_orig.action_taken == min_label]
+
+    df_majority_downsampled = resample(df_majority,
+                                       replace=False,  # sample without replacement
+                                       n_samples=len(df_minority.index),  # to match minority class
+                                       random_state=random_state)
+    # Combine minority class with down sampled majority class
+    df_downsampled = pd.concat([df_majority_downsampled, df_minority])
+
+    df_downsampled.reset_index(drop=True, inplace=True)
+
+    return df_downsampled
+
+
+# TODO: simplify function
+def smote_balance(comb_df, rng=None, knn_cache_dir=None, knn_algorithm='auto'):
+    def apply_smote(df):
+        df.reset_index(drop=True, inplace=True)
+        cols = df.columns
+        smt = SMOTE(df, rng=rng, knn_cache_dir=knn_cache_dir, knn_algorithm=knn_algorithm)
+        df = smt.run()
+        df.columns = cols
+        return df
+
+    X_train, y_train = comb_df.loc[:, comb_df.columns != 'action_taken'], comb_df['action_taken']
+
+    train_df = X_train
+    train_df['action_taken'] = y_train
+    train_df["action_taken"] = y_train.astype("category")
+
+    train_df = apply_smote(train_df)
+
+    return train_df
+
+
+def balance_subgroup(c, pos_count, neg_count, mean_val, seed, conditional=False, knn_cache_dir=None,
+                     knn_algorithm='auto'):
+    """
+    Balance one intersectional subgroup to mean_val rows per label.
+
+    Depends only on its arguments, so subgroups can be balanced in any order or process.
+
+    :param c: Subgroup DataFrame.
+    :param pos_count: Number of rows with action_taken == 1.
+    :param neg_count: Number of rows with action_taken == 0.
+    :param mean_val: Target number of rows per label.
+    :param seed: Seed (or numpy.random.SeedSequence) for this subgroup's random choices.
+    :param conditional: Generate each label's samples from that label's rows (generate_samples_conditional)
+                        instead of keeping the candidates that happen to land on the label.
+    :param knn_cache_dir: Directory of cached neighbor graphs (see neighbors.NeighborIndex), or None.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: ('RUS' or 'smote', balanced DataFrame), or None if the subgroup is left out (as one without rows is).
+    """
+
+    # Subgroups without rows (combinations of get_unique_df absent from the data) have nothing to balance
+    if pos_count + neg_count == 0:
+        return None
+
+    rng = np.random.default_rng(seed)
+    current_max, current_min = max(pos_count, neg_count), min(pos_count, neg_count)
+    # Formatting frames is expensive, so only build the debug output when it will be emitted
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug('subgroup max %d min %d target %d\n%s', current_max, current_min, mean_val,
+                     c[['derived_ethnicity', 'derived_race', 'derived_sex', 'action_taken']])
+
+    knn_options = {'knn_cache_dir': knn_cache_dir, 'knn_algorithm': knn_algorithm}
+    if current_max < mean_val:
+        kind, df = 'smote', smote_balance(c, rng=rng, **knn_options)
+    elif (current_max > mean_val) and (current_min < mean_val):
+        diff_to_max = current_max - mean_val
+        diff_to_min = mean_val - current_min
+        if diff_to_max < diff_to_min:
+            kind, df = 'RUS', smote_balance(c, rng=rng, **knn_options)
+        else:
+            kind, df = 'smote', RUS_balance(c)
+    elif (current_max > mean_val) and (current_min > mean_val):
+        kind, df = 'RUS', RUS_balance(c)
+    else:
+        return None
+
+    if kind == 'RUS':
+        num_decrease_of_0 = len(df[(df['action_taken'] == 0)]) - mean_val
+        num_decrease_of_1 = len(df[(df['action_taken'] == 1)]) - mean_val
+
+        if debug:
+            logger.debug('Before Distribution\n%s', df['action_taken'].value_counts())
+
+        df = delete_samples(df, 'action_taken', 0, num_decrease_of_0, rng=rng)
+        df = delete_samples(df, 'action_taken', 1, num_decrease_of_1, rng=rng)
+
+        if debug:
+            logger.debug('After Distribution\n%s', df['action_taken'].value_counts())
+        return kind, df
+
+    num_increase_of_0 = mean_val - len(df[(df['action_taken'] == 0)])
+    num_increase_of_1 = mean_val - len(df[(df['action_taken'] == 1)])
+
+    if debug:
+        logger.debug('Num of Increase: %d %d', num_increase_of_0, num_increase_of_1)
+        logger.debug('Before Distribution\n%s', df['action_taken'].value_counts())
+
+    generate = generate_samples_conditional if conditional else generate_samples_batched
+    df_zeros, df_ones = generate(num_increase_of_0, num_increase_of_1, df, 'HMDA', rng=rng, **knn_options)
+    df_added = pd.concat([df_zeros, df_ones])
+    concat_df = pd.concat([df, df_added])
+    concat_df = concat_df.sample(frac=1, random_state=rng).reset_index(drop=True)
+    if debug:
+        logger.debug('After Distribution\n%s', concat_df['action_taken'].value_counts())
+    return kind, concat_df
+
+
+def apply_balancing(subgroup_index, mean_val, seed=0, n_workers=1, conditional=False, knn_cache_dir=None,
+                    knn_algorithm='auto'):
+    """
+    Balance every subgroup of a SubgroupIndex and shuffle the results together.
+
+    Every subgroup gets its own seed spawned from the master seed, so the output is identical for any n_workers.
+
+    :param subgroup_index: SubgroupIndex of the dataset to balance.
+    :param mean_val: Target number of rows per label in every subgroup.
+    :param seed: Master seed.
+    :param n_workers: Number of worker processes; 1 balances in this process.
+    :param conditional: Use class-conditional generation (see balance_subgroup).
+    :param knn_cache_dir: Directory of cached neighbor graphs; with it, reruns over the same subgroups reuse them.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: Balanced DataFrame.
+    """
+
+    seeds = np.random.SeedSequence(seed).spawn(len(subgroup_index) + 1)
+    counts = [subgroup_index.label_counts(i) for i in range(len(subgroup_index))]
+    args = (subgroup_index, [pos for pos, _ in counts], [neg for _, neg in counts], [mean_val] * len(counts),
+            seeds[:-1], [conditional] * len(counts), [knn_cache_dir] * len(counts), [knn_algorithm] * len(counts))
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(balance_subgroup, *args))
+    else:
+        results = list(map(balance_subgroup, *args))
+
+    super_balanced_RUS = [df for kind, df in filter(None, results) if kind == 'RUS']
+    super_balanced_smote = [df for kind, df in filter(None, results) if kind == 'smote']
+
+    def concat_and_shuffle(smote_version, RUS_version):
+        concat_smote_df = pd.concat(smote_version)
+        concat_RUS_df = pd.concat(RUS_version)
+        total_concat_df = pd.concat([concat_RUS_df, concat_smote_df])
+        total_concat_df = total_concat_df.sample(frac=1, random_state=np.random.default_rng(seeds[-1]))
+        total_concat_df = total_concat_df.reset_index(drop=True)
+        # Synthetic rows come out of the arithmetic as float64; keep the dtypes of the input (e.g. compact ones)
+        total_concat_df = total_concat_df.astype(subgroup_index.df.dtypes.to_dict())
+
+        logger.debug('Shuffle:\n%s', total_concat_df.head(50))
+        return total_concat_df
+
+    return concat_and_shuffle(super_balanced_smote, super_balanced_RUS)
+
+
+# How plan_balancing balances a subgroup; the cases of balance_subgroup
+SKIP, OVERSAMPLE, SMOTE_THEN_RUS, RUS_THEN_GENERATE, UNDERSAMPLE = range(5)
+
+
+def plan_balancing(pos_counts, neg_counts, mean_val, rng):
+    """
+    Choose how every subgroup is balanced and how many of its real rows each label keeps, from one count table.
+
+    The strategy follows balance_subgroup: subgroups below the target on both labels are oversampled with SMOTE and
+    generated samples; subgroups straddling it either SMOTE their minority and then undersample both labels, or
+    undersample their majority to the minority count and then generate samples, whichever is the smaller change;
+    subgroups above it on both labels are undersampled; the rest, and subgroups without rows, are left out. When
+    SMOTE rows are undersampled together with the real minority rows, the number of real rows kept is drawn from the
+    same hypergeometric distribution as that undersampling.
+
+    :param pos_counts: Number of rows with label 1 of every subgroup.
+    :param neg_counts: Number of rows with label 0 of every subgroup.
+    :param mean_val: Target number of rows per label.
+    :param rng: numpy.random.Generator for the hypergeometric draws.
+    :return: Strategy of every subgroup and a (subgroups x 2) array of real rows kept per label (0, 1).
+    """
+
+    counts = np.column_stack([neg_counts, pos_counts]).astype(np.int64)
+    current_max, current_min = counts.max(axis=1), counts.min(axis=1)
+    straddles = (current_max > mean_val) & (current_min < mean_val)
+    # Subgroups without rows (combinations of get_unique_df absent from the data) have nothing to balance
+    kinds = np.select([current_max == 0, current_max < mean_val,
+                       straddles & (current_max - mean_val < mean_val - current_min),
+                       straddles, (current_max > mean_val) & (current_min > mean_val)],
+                      [SKIP, OVERSAMPLE, SMOTE_THEN_RUS, RUS_THEN_GENERATE, UNDERSAMPLE], SKIP)
+
+    keep = np.zeros_like(counts)
+    keep[kinds == OVERSAMPLE] = counts[kinds == OVERSAMPLE]
+    keep[kinds == UNDERSAMPLE] = mean_val
+    keep[kinds == RUS_THEN_GENERATE] = np.minimum(counts, current_min[:, None])[kinds == RUS_THEN_GENERATE]
+
+    smote_then_rus = np.flatnonzero(kinds == SMOTE_THEN_RUS)
+    if smote_then_rus.size:
+        majority = counts[smote_then_rus].argmax(axis=1)
+        n_min = current_min[smote_then_rus]
+        keep[smote_then_rus, majority] = mean_val
+        # SMOTE brings the minority to current_max rows, of which mean_val are kept at random
+        keep[smote_then_rus, 1 - majority] = rng.hypergeometric(n_min, current_max[smote_then_rus] - n_min,
+                                                                np.full(smote_then_rus.size, mean_val))
+    return kinds, keep
+
+
+def shuffle_cells(subgroup_index, rng):
+    """
+    Row positions sorted by (subgroup, label) cell, cell 2 * subgroup + label, in random order within each cell.
+
+    :param subgroup_index: SubgroupIndex of the dataset.
+    :param rng: numpy.random.Generator.
+    :return: The shuffled positions and the cell of each of them.
+    """
+
+    positions = subgroup_index.order
+    groups = np.repeat(np.arange(len(subgroup_index)), np.diff(subgroup_index.bounds))
+    labels = subgroup_index.df[subgroup_index.label_col].to_numpy()[positions]
+    cells = 2 * groups + (labels == 1)
+
+    ranked = np.lexsort((rng.random(len(positions)), cells))
+    return positions[ranked], cells[ranked]
+
+
+def cell_prefixes(cells, n_taken):
+    """Mask of the first n_taken[cell] entries of every cell of a cell-sorted array."""
+    rank = np.arange(len(cells)) - np.searchsorted(cells, cells)
+    return rank < n_taken[cells]
+
+
+def select_rows(subgroup_index, keep, rng):
+    """
+    Row positions kept by a plan, chosen at random within every (subgroup, label) cell in one vectorized pass.
+
+    :param subgroup_index: SubgroupIndex of the dataset.
+    :param keep: (subgroups x 2) array of rows kept per label, from plan_balancing.
+    :param rng: numpy.random.Generator.
+    :return: Kept row positions, grouped by subgroup.
+    """
+
+    # The first keep[cell] rows of every shuffled cell are kept
+    positions, cells = shuffle_cells(subgroup_index, rng)
+    return positions[cell_prefixes(cells, keep.ravel())]
+
+
+def synthesize_subgroup(c, kind, mean_val, n_smote, seed, conditional=False, knn_cache_dir=None,
+                        knn_algorithm='auto'):
+    """
+    Synthetic rows of one subgroup under its plan_balancing strategy.
+
+    :param c: Real rows the synthetic ones are generated from: the whole subgroup for OVERSAMPLE and SMOTE_THEN_RUS,
+              the rows kept by the undersampling for RUS_THEN_GENERATE.
+    :param kind: Strategy from plan_balancing.
+    :param mean_val: Target number of rows per label.
+    :param n_smote: Number of SMOTE rows of the minority label kept (SMOTE_THEN_RUS only).
+    :param seed: Seed (or numpy.random.SeedSequence) for this subgroup's random choices.
+    :param conditional: Use class-conditional generation (see balance_subgroup).
+    :param knn_cache_dir: Directory of cached neighbor graphs (see neighbors.NeighborIndex), or None.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: DataFrame of synthetic rows with the columns of c.
+    """
+
+    rng = np.random.default_rng(seed)
+    knn_options = {'knn_cache_dir': knn_cache_dir, 'knn_algorithm': knn_algorithm}
+    c = c.reset_index(drop=True)
+
+    if kind == SMOTE_THEN_RUS:
+        labels = c['action_taken'].to_numpy()
+        n_min = min((labels == 0).sum(), (labels == 1).sum())
+        if n_min == 0:
+            logger.warning('Subgroup without a minority label: no SMOTE rows to keep %d of', n_smote)
+        if n_smote == 0 or n_min == 0:
+            return c.iloc[:0]
+        smoted = SMOTE(c, up_to_num=n_min + n_smote, rng=rng, **knn_options).run()
+        smoted.columns = c.columns
+        return smoted.iloc[len(c):]
+
+    synthetic = []
+    if kind == OVERSAMPLE:
+        smoted = smote_balance(c.copy(), rng=rng, **knn_options)
+        smoted['action_taken'] = smoted['action_taken'].astype(c['action_taken'].dtype)
+        synthetic.append(smoted.iloc[len(c):])
+        c = smoted
+
+    labels = c['action_taken'].to_numpy()
+    generate = generate_samples_conditional if conditional else generate_samples_batched
+    df_zeros, df_ones = generate(mean_val - (labels == 0).sum(), mean_val - (labels == 1).sum(), c, 'HMDA', rng=rng,
+                                 **knn_options)
+    df_zeros.columns, df_ones.columns = c.columns, c.columns
+    return pd.concat(synthetic + [df_zeros, df_ones], ignore_index=True)
+
+
+def assemble(df, kept, synthetic, rng):
+    """
+    Build the balanced dataset: the kept rows of df gathered once, plus the synthetic rows, in one random order.
+
+    Every column is written straight into its shuffled output positions, in the dtype of df.
+    """
+
+    synthetic = [frame for frame in synthetic if len(frame)]
+    n_real = len(kept)
+    n_rows = n_real + sum(len(frame) for frame in synthetic)
+    destination = rng.permutation(n_rows)
+
+    columns = {}
+    for j, col in enumerate(df.columns):
+        values = np.empty(n_rows, dtype=df[col].dtype)
+        values[destination[:n_real]] = df[col].to_numpy()[kept]
+        if synthetic:
+            values[destination[n_real:]] = np.concatenate([frame.iloc[:, j].to_numpy() for frame in synthetic])
+        columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def plan_and_balance(subgroup_index, mean_val, seed=0, n_workers=1, conditional=False, knn_cache_dir=None,
+                     knn_algorithm='auto'):
+    """
+    Balance every subgroup like apply_balancing, without building per-subgroup frames for the undersampling.
+
+    plan_balancing turns the label count table into kept-row counts per (subgroup, label) cell, select_rows picks
+    all kept rows in one seeded pass, only subgroups that need synthetic rows are handed to synthesize_subgroup
+    (in parallel with n_workers), and assemble gathers the kept rows once and shuffles them with the synthetic ones.
+    The label counts of the result equal those of apply_balancing; the rows drawn differ. The output is identical
+    for any n_workers.
+
+    :param subgroup_index: SubgroupIndex of the dataset to balance.
+    :param mean_val: Target number of rows per label in every subgroup.
+    :param seed: Master seed.
+    :param n_workers: Number of worker processes generating synthetic rows; 1 generates in this process.
+    :param conditional: Use class-conditional generation (see balance_subgroup).
+    :param knn_cache_dir: Directory of cached neighbor graphs; with it, reruns over the same subgroups reuse them.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: Balanced DataFrame.
+    """
+
+    seeds = np.random.SeedSequence(seed).spawn(len(subgroup_index) + 2)
+    plan_rng = np.random.default_rng(seeds[-2])
+    kinds, keep = plan_balancing(subgroup_index.pos_counts, subgroup_index.neg_counts, mean_val, plan_rng)
+    kept = select_rows(subgroup_index, keep, plan_rng)
+
+    # kept holds exactly keep.sum() rows per subgroup, in subgroup order. Only the RUS_THEN_GENERATE subgroups
+    # generate from their kept rows; the others generate from all of their rows
+    kept_bounds = np.concatenate([[0], np.cumsum(keep.sum(axis=1))])
+    tasks = []
+    for i in np.flatnonzero(np.isin(kinds, [OVERSAMPLE, SMOTE_THEN_RUS, RUS_THEN_GENERATE])):
+        rows = subgroup_index.positions(i)
+        if kinds[i] == RUS_THEN_GENERATE:
+            rows = kept[kept_bounds[i]:kept_bounds[i + 1]]
+        tasks.append((subgroup_index.df.iloc[rows], kinds[i], mean_val, mean_val - keep[i].min(), seeds[i]))
+    logger.debug('Plan: %s', dict(zip(*np.unique(kinds, return_counts=True))))
+
+    args = list(zip(*tasks)) or [[]] * 5
+    options = [[conditional] * len(tasks), [knn_cache_dir] * len(tasks), [knn_algorithm] * len(tasks)]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            synthetic = list(executor.map(synthesize_subgroup, *args, *options))
+    else:
+        synthetic = list(map(synthesize_subgroup, *args, *options))
+
+    return assemble(subgroup_index.df, kept, synthetic, np.random.default_rng(seeds[-1]))
@@ -0,0 +1,130 @@
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.tree import DecisionTreeClassifier
+
+from smote import SMOTE
+from sampling import generate_samples_batched, generate_samples_conditional, delete_samples
+from preprocess import preprocessing
+from subgroups import SubgroupIndex, split_dataset
+from balancing import RUS_balance, plan_and_balance
+from situation_testing import situation_test
+from evaluate import EvaluationSession, default_model
+from synthetic import make_synthetic_hmda
+
+ind_cols = ['derived_ethnicity', 'derived_race', 'derived_sex']
+
+
+def measure(stages, name, fn, rows_in, track_memory=True):
+    """
+    Run one stage, recording its wall time, peak traced memory and row counts.
+
+    :param stages: List the stage record is appended to.
+    :param name: Stage name.
+    :param fn: Zero-argument callable running the stage.
+    :param rows_in: Number of input rows.
+    :param track_memory: Trace allocations to report peak memory (slows allocation-heavy stages a little).
+    :return: Whatever fn returns.
+    """
+
+    gc.collect()
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    out = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    if track_memory:
+        tracemalloc.stop()
+
+    rows_out = len(out[0]) if isinstance(out, tuple) else len(out) if hasattr(out, '__len__') else None
+    record = {'stage': name, 'seconds': seconds, 'rows_in': rows_in, 'rows_out': rows_out,
+              'rows_per_second': rows_in / seconds if seconds else None}
+    # Without tracking there is no measurement, so no peak is recorded rather than a misleading 0
+    if track_memory:
+        record['peak_bytes'] = peak
+    stages.append(record)
+    peak_text = f"{peak / 2 ** 20:9.1f} MiB" if track_memory else f"{'n/a':>9}"
+    print(f"{name:>28}: {seconds:9.3f} s  peak {peak_text}", file=sys.stderr)
+    return out
+
+
+def run_benchmark(n_rows, seed=0, track_memory=True, compact=False):
+    """Time every pipeline stage on n_rows of synthetic data (compact dtypes if asked); returns the run record."""
+    stages = []
+    raw = make_synthetic_hmda(n_rows, seed)
+
+    processed = measure(stages, 'preprocessing', lambda: preprocessing(raw, compact), len(raw), track_memory)
+    measure(stages, 'split_dataset', lambda: split_dataset(processed, ind_cols), len(processed), track_memory)
+
+    index = SubgroupIndex(processed, ind_cols)
+    mean_val = index.median_target()
+    both_labels = [i for i in range(len(index)) if min(index.label_counts(i)) > 5]
+    sizes = np.array([sum(index.label_counts(i)) for i in both_labels])
+    subgroup = index[both_labels[np.argmin(np.abs(sizes - 2 * mean_val))]]
+    largest = index[both_labels[np.argmax(sizes)]]
+
+    measure(stages, 'SMOTE.run', lambda: SMOTE(subgroup, rng=seed).run(), len(subgroup), track_memory)
+    measure(stages, 'generate_samples', lambda: generate_samples_batched(mean_val, mean_val, subgroup, 'HMDA',
+                                                                         rng=seed), len(subgroup), track_memory)
+    measure(stages, 'generate_samples_conditional',
+            lambda: generate_samples_conditional(mean_val, mean_val, subgroup, 'HMDA', rng=seed), len(subgroup),
+            track_memory)
+
+    def rus():
+        rng = np.random.default_rng(seed)
+        df = RUS_balance(largest)
+        df = delete_samples(df, 'action_taken', 0, (df['action_taken'] == 0).sum() - mean_val, rng=rng)
+        return delete_samples(df, 'action_taken', 1, (df['action_taken'] == 1).sum() - mean_val, rng=rng)
+    measure(stages, 'RUS_balance/delete_samples', rus, len(largest), track_memory)
+    measure(stages, 'plan_and_balance', lambda: plan_and_balance(index, mean_val, seed=seed), len(processed),
+            track_memory)
+
+    X = processed.drop(columns='action_taken')
+    y = processed['action_taken']
+    protected_idx = [X.columns.get_loc(col) for col in ind_cols]
+    linear = default_model().fit(X.to_numpy(), y)
+    tree = DecisionTreeClassifier(max_depth=8, random_state=seed).fit(X.to_numpy(), y)
+    measure(stages, 'situation_testing', lambda: situation_test(linear, X, protected_idx, index.unique_df),
+            len(X), track_memory)
+    measure(stages, 'situation_testing_generic', lambda: situation_test(tree, X, protected_idx, index.unique_df),
+            len(X), track_memory)
+
+    measure(stages, 'evaluate', lambda: EvaluationSession(processed).evaluate_all(ind_cols, index.unique_df),
+            len(processed), track_memory)
+
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rows': n_rows, 'seed': seed,
+            'track_memory': track_memory, 'compact': compact, 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__,
+            'machine': platform.platform(), 'cpus': os.cpu_count(), 'stages': stages}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic HMDA-shaped data.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000], help="dataset sizes to run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc peak-memory tracking")
+    parser.add_argument('--compact', action='store_true', help="float32 features and an int8 label")
+    parser.add_argument('--output', default=os.path.join('Results', 'benchmarks.jsonl'),
+                        help="JSON-lines file every run record is appended to")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    for n_rows in args.rows:
+        print(f"--- {n_rows} rows ---", file=sys.stderr)
+        record = run_benchmark(n_rows, args.seed, not args.no_memory, args.compact)
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
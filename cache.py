@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(input_files, **settings):
+    """
+    Fingerprint a preprocessing run.
+
+    :param input_files: Raw input files; their contents (not their names) go into the key.
+    :param settings: Everything else the output depends on (sample sizes, seed, preprocessing settings), JSON-encodable.
+    :return: Hex digest identifying the run.
+    """
+
+    fingerprint = {'files': [file_hash(path) for path in input_files], 'settings': settings}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_frame(cache_dir, key):
+    """
+    Load a cached frame, memory-mapped copy-on-write.
+
+    :return: DataFrame, or None on a cache miss.
+    """
+
+    entry = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(entry, 'schema.json')):
+        return None
+
+    with open(os.path.join(entry, 'schema.json')) as f:
+        schema = json.load(f)
+
+    # Stored column-major so every column is a contiguous slice of the map
+    values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='c')
+    df = pd.DataFrame(values.T, columns=schema['columns'], copy=False)
+
+    # Columns narrower than the stored matrix (e.g. an int8 label next to float32 features) are converted back
+    for col, dtype in zip(schema['columns'], schema.get('dtypes', [])):
+        if dtype != str(values.dtype):
+            # Column-wise, so the other columns keep sharing the map
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def save_frame(df, cache_dir, key):
+    """Store a numeric frame as a column-major .npy file of its common dtype plus a JSON schema."""
+    entry = os.path.join(cache_dir, key)
+    os.makedirs(entry, exist_ok=True)
+
+    values = np.ascontiguousarray(df.to_numpy().T)
+    # Unique temporary names, so concurrent runs saving the same entry do not collide, and replacing rather than
+    # overwriting values.npy leaves the file other runs have memory-mapped intact
+    tmp_path = os.path.join(entry, f'values.npy.{os.getpid()}.tmp.npy')
+    np.save(tmp_path, values)
+    os.replace(tmp_path, os.path.join(entry, 'values.npy'))
+
+    # The schema is written last, so an interrupted save is treated as a miss
+    schema = {'columns': list(df.columns), 'dtype': str(values.dtype), 'shape': list(df.shape),
+              'dtypes': [str(dtype) for dtype in df.dtypes]}
+    tmp_path = os.path.join(entry, f'schema.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(schema, f)
+    os.replace(tmp_path, os.path.join(entry, 'schema.json'))
+
+
+def derive_key(parent_key, stage, **settings):
+    """Key of a stage output computed from the output keyed by parent_key with the given settings."""
+    fingerprint = {'parent': parent_key, 'stage': stage, 'settings': settings}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_record(cache_dir, key):
+    """Load a cached JSON record, or None on a cache miss."""
+    path = os.path.join(cache_dir, key, 'record.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_record(record, cache_dir, key):
+    """Store a JSON-encodable record, replacing it atomically."""
+    entry = os.path.join(cache_dir, key)
+    os.makedirs(entry, exist_ok=True)
+    # Unique temporary name, so concurrent runs saving the same record do not collide
+    tmp_path = os.path.join(entry, f'record.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, os.path.join(entry, 'record.json'))
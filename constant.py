@@ -12,3 +12,15 @@ column_labels = ['derived_msa-md', 'derived_loan_product_type', 'derived_ethnici
                 'tract_minority_population_percent', 'ffiec_msa_md_median_family_income',
                 'tract_to_msa_income_percentage', 'tract_owner_occupied_units', 'tract_one_to_four_family_homes',
                 'tract_median_age_of_housing_units', 'action_taken']
+
+# String-valued columns of the raw HMDA files, read as pandas categoricals
+categorical_columns = ['derived_loan_product_type', 'derived_ethnicity', 'derived_race', 'derived_sex', 'action_taken']
+
+# Codes for the protected attributes and the label; rows with any other value are dropped in preprocessing
+sex_codes = {'Female': 0, 'Male': 1, 'Joint': 2}
+race_codes = {'Black or African American': 0, 'White': 1, 'Joint': 2}
+ethnicity_codes = {'Hispanic or Latino': 0, 'Not Hispanic or Latino': 1, 'Joint': 2}
+action_taken_codes = {'1': 1, '2': 0, '3': 0}
+
+code_maps = {'derived_sex': sex_codes, 'derived_race': race_codes, 'derived_ethnicity': ethnicity_codes,
+             'action_taken': action_taken_codes}
@@ -1,33 +1,143 @@
+import logging
+
 import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+
+from situation_testing import situation_test
+from preprocess import split_features
+
+logger = logging.getLogger(__name__)
+
+# Position in a (TP, TN, FN, FP) row of each (label, prediction) pair, indexed by 2 * label + prediction
+CELL_OF_OUTCOME = np.array([1, 3, 2, 0])
+
+
+def group_confusion_matrices(y_true, y_pred, groups):
+    """
+    Confusion counts of every protected-attribute value from a single bincount.
+
+    Rows whose label or prediction is not 0/1 are not counted, as in calculate_confusion_matrix_elements.
+
+    :param y_true: Labels.
+    :param y_pred: Predictions.
+    :param groups: Protected-attribute value of every row.
+    :return: Sorted group values and a (n_groups, 4) table of TP, TN, FN, FP per group.
+    """
+
+    y_true, y_pred, groups = np.asarray(y_true), np.asarray(y_pred), np.asarray(groups)
+    values, group_codes = np.unique(groups, return_inverse=True)
+
+    valid = np.isin(y_true, (0, 1)) & np.isin(y_pred, (0, 1))
+    outcome = CELL_OF_OUTCOME[2 * y_true[valid].astype(int) + y_pred[valid].astype(int)]
+    table = np.bincount(group_codes.ravel()[valid] * 4 + outcome, minlength=len(values) * 4).reshape(-1, 4)
+
+    return values, table
+
+
+def group_counts(values, table, bias_value):
+    """TP, TN, FN, FP of one group value from a group_confusion_matrices table, zeros if the value is absent."""
+    matches = np.flatnonzero(values == bias_value)
+    return tuple(table[matches[0]]) if len(matches) else (0, 0, 0, 0)
+
+
+def table_ratio(num, den):
+    return np.divide(num, den, out=np.zeros(np.shape(num)), where=np.asarray(den) != 0)
+
+
+def table_metrics(table, privileged=0.5, unprivileged=0, values=None):
+    """
+    Derive every metric from a group_confusion_matrices table.
+
+    :param table: (n_groups, 4) TP, TN, FN, FP table.
+    :param privileged: Privileged group value for EOD/AOD.
+    :param unprivileged: Unprivileged group value for EOD/AOD.
+    :param values: Group values of the table rows.
+    :return: Dict of per-group recall, far, precision and accuracy arrays, the same metrics and F1 over all rows
+             (overall_*) and the EOD and AOD between the privileged and unprivileged groups.
+    """
+
+    TP, TN, FN, FP = np.asarray(table, dtype=float).T
+    metrics = {'recall': table_ratio(TP, TP + FN), 'far': table_ratio(FP, FP + TN),
+               'precision': table_ratio(TP, TP + FP), 'accuracy': table_ratio(TP + TN, TP + TN + FP + FN)}
+
+    TP_all, TN_all, FN_all, FP_all = TP.sum(), TN.sum(), FN.sum(), FP.sum()
+    metrics.update({'overall_recall': calculate_ratio(TP_all, TP_all + FN_all),
+                    'overall_far': calculate_ratio(FP_all, FP_all + TN_all),
+                    'overall_precision': calculate_ratio(TP_all, TP_all + FP_all),
+                    'overall_accuracy': calculate_ratio(TP_all + TN_all, TP_all + TN_all + FP_all + FN_all),
+                    'overall_F1': calculate_F1(TP_all, FP_all, FN_all, TN_all)})
+
+    if values is not None:
+        counts = group_counts(values, table, privileged) + group_counts(values, table, unprivileged)
+        metrics['eod'] = calculate_equal_opportunity_difference(*counts)
+        metrics['aod'] = calculate_equalizied_odds_difference(*counts)
+
+    return metrics
+
+
+def bootstrap_tables(table, n_resamples=2000, rng=None):
+    """
+    Confusion tables of bootstrap resamples of the rows counted in a table, drawn without touching the rows.
+
+    Resampling the n counted rows with replacement gives cell counts multinomially distributed over the table's
+    cell shares, so every resample comes from one batched multinomial draw.
+
+    :param table: (n_groups, 4) TP, TN, FN, FP table from group_confusion_matrices.
+    :param n_resamples: Number of resamples.
+    :param rng: numpy Generator or seed.
+    :return: (n_resamples, n_groups, 4) array of resampled tables.
+    """
+
+    rng = np.random.default_rng(rng)
+    table = np.asarray(table)
+    n = int(table.sum())
+    if n == 0:
+        return np.zeros((n_resamples,) + table.shape, dtype=np.int64)
+    return rng.multinomial(n, table.ravel() / n, size=n_resamples).reshape((n_resamples,) + table.shape)
+
+
+def group_tables(tables, values, bias_value):
+    """(..., 4) counts of one group value from stacked tables, zeros if the value is absent."""
+    matches = np.flatnonzero(values == bias_value)
+    tables = np.asarray(tables)
+    return tables[..., matches[0], :] if len(matches) else np.zeros(tables.shape[:-2] + (4,), dtype=tables.dtype)
 
-def calculate_confusion_matrix_elements(test_df, biased_col, y_pred, bias_value):
-    test_df = test_df.copy()
-    current_pred_col = f'current_pred_{biased_col}'
-    test_df[current_pred_col] = y_pred
 
-    TP = np.where((test_df['action_taken'] == 1) &
-                  (test_df[current_pred_col] == 1) &
-                  (test_df[biased_col] == bias_value), 1, 0).sum()
+def fairness_differences(tables, values, privileged=0.5, unprivileged=0):
+    """
+    EOD and AOD of every stacked table at once, as calculate_equal_opportunity_difference and
+    calculate_equalizied_odds_difference compute them for a single one.
 
-    TN = np.where((test_df['action_taken'] == 0) &
-                  (test_df[current_pred_col] == 0) &
-                  (test_df[biased_col] == bias_value), 1, 0).sum()
+    :param tables: (..., n_groups, 4) TP, TN, FN, FP tables, e.g. from bootstrap_tables.
+    :param values: Group values of the table rows.
+    :return: EOD and AOD arrays of shape tables.shape[:-2].
+    """
 
-    FN = np.where((test_df['action_taken'] == 1) &
-                  (test_df[current_pred_col] == 0) &
-                  (test_df[biased_col] == bias_value), 1, 0).sum()
+    TP_p, TN_p, FN_p, FP_p = np.moveaxis(group_tables(tables, values, privileged), -1, 0)
+    TP_up, TN_up, FN_up, FP_up = np.moveaxis(group_tables(tables, values, unprivileged), -1, 0)
+    TPR_p, TPR_up = table_ratio(TP_p, TP_p + FN_p), table_ratio(TP_up, TP_up + FN_up)
+    FPR_p, FPR_up = table_ratio(FP_p, FP_p + TN_p), table_ratio(FP_up, FP_up + TN_up)
+    return TPR_p - TPR_up, ((FPR_up - FPR_p) + (TPR_up - TPR_p)) * 0.5
 
-    FP = np.where((test_df['action_taken'] == 0) &
-                  (test_df[current_pred_col] == 1) &
-                  (test_df[biased_col] == bias_value), 1, 0).sum()
 
-    return TP, TN, FN, FP
+def percentile_interval(samples, alpha=0.05):
+    """Two-sided percentile interval holding 1 - alpha of the samples."""
+    low, high = np.quantile(samples, [alpha / 2, 1 - alpha / 2])
+    return float(low), float(high)
+
+
+def calculate_confusion_matrix_elements(test_df, biased_col, y_pred, bias_value):
+    values, table = group_confusion_matrices(test_df['action_taken'], y_pred, test_df[biased_col])
+    return group_counts(values, table, bias_value)
+
 
 def calculate_matrix_up_and_p(test_df, biased_col, y_pred):
-    TP_p, TN_p, FN_p, FP_p = calculate_confusion_matrix_elements(test_df, biased_col, y_pred, 0.5)
-    TP_up, TN_up, FN_up, FP_up = calculate_confusion_matrix_elements(test_df, biased_col, y_pred, 0)
+    values, table = group_confusion_matrices(test_df['action_taken'], y_pred, test_df[biased_col])
+    TP_p, TN_p, FN_p, FP_p = group_counts(values, table, 0.5)
+    TP_up, TN_up, FN_up, FP_up = group_counts(values, table, 0)
 
-    print(TP_p, TN_p, FN_p, FP_p, TP_up, TN_up, FN_up, FP_up)
+    logger.debug('%s %s %s %s %s %s %s %s', TP_p, TN_p, FN_p, FP_p, TP_up, TN_up, FN_up, FP_up)
     return TP_p, TN_p, FN_p, FP_p, TP_up, TN_up, FN_up, FP_up
 
 def calculate_ratio(num, den):
@@ -38,7 +148,7 @@ def calculate_equal_opportunity_difference(TP_p, TN_p, FN_p, FP_p, TP_up, TN_up,
     TPR_up = calculate_ratio(TP_up, TP_up + FN_up)
 
     diff = TPR_p - TPR_up
-    print(f"TPR_priv: {TPR_p}, TPR_unpriv: {TPR_up}, Difference: {diff}")
+    logger.debug("TPR_priv: %s, TPR_unpriv: %s, Difference: %s", TPR_p, TPR_up, diff)
     return diff
 
 def calculate_equalizied_odds_difference(TP_p, TN_p, FN_p, FP_p, TP_up, TN_up, FN_up, FP_up):
@@ -48,7 +158,8 @@ def calculate_equalizied_odds_difference(TP_p, TN_p, FN_p, FP_p, TP_up, TN_up, F
     FPR_up = calculate_ratio(FP_up, FP_up + TN_up)
 
     diff = ((FPR_up - FPR_p) + (TPR_up - TPR_p)) * 0.5
-    print(f"TPR_priv: {TPR_p}, TPR_unpriv: {TPR_up}, FPR_priv: {FPR_p}, FPR_unpriv: {FPR_up}, Difference: {diff}")
+    logger.debug("TPR_priv: %s, TPR_unpriv: %s, FPR_priv: %s, FPR_unpriv: %s, Difference: %s",
+                 TPR_p, TPR_up, FPR_p, FPR_up, diff)
     return diff
 
 def run_pipeline(test_df, biased_col, y_pred, metric_function):
@@ -73,3 +184,147 @@ def calculate_precision(TP, FP, _, __):
 
 def calculate_accuracy(TP, FP, FN, TN):
     return calculate_ratio(TP + TN, TP + TN + FP + FN)
+
+def calculate_F1(TP, FP, FN, TN):
+    precision = calculate_precision(TP, FP, FN, TN)
+    recall = calculate_recall(TP, FP, FN, TN)
+    return round(calculate_ratio(2 * precision * recall, precision + recall), 2)
+
+
+def default_model():
+    return LogisticRegression(C=1.0, penalty='l2', solver='liblinear', max_iter=100)
+
+
+class EvaluationSession:
+    def __init__(self, df, label_col='action_taken', test_size=0.3, random_state=0, make_model=default_model):
+        """
+        Split a dataset and fit its model once, then serve every metric from the shared split and predictions.
+
+        :param df: Dataset with the label column and the protected columns.
+        :param label_col: Label column.
+        :param test_size: Fraction of rows held out for testing.
+        :param random_state: Seed of the train/test split.
+        :param make_model: Zero-argument factory returning an unfitted classifier.
+        """
+        self.df = df
+        self.label_col = label_col
+        self.make_model = make_model
+        self.feature_cols = df.columns[df.columns != label_col]
+        # Views of the frame's columns, so row gathers below are the only copies
+        self.X, self.y = split_features(df, label_col)
+
+        # Split row positions only; same rows as splitting the frame itself
+        self.train_idx, self.test_idx = train_test_split(np.arange(len(df)), test_size=test_size,
+                                                         random_state=random_state, shuffle=True)
+        self._model = None
+        self._y_pred = None
+        self._tables = {}
+        self._metrics = {}
+
+    def features(self, idx):
+        return self.X[idx]
+
+    def labels(self, idx):
+        return self.y[idx]
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.make_model()
+            if hasattr(self._model, 'fit_source'):
+                # Out-of-core models read the training rows chunk by chunk
+                self._model.fit_source(self.df, self.label_col, rows=self.train_idx)
+            else:
+                self._model.fit(self.features(self.train_idx), self.labels(self.train_idx))
+        return self._model
+
+    @property
+    def y_pred(self):
+        if self._y_pred is None:
+            self._y_pred = self.model.predict(self.features(self.test_idx))
+        return self._y_pred
+
+    def confusion_table(self, biased_col):
+        """Cached group_confusion_matrices of the test predictions for one protected column."""
+        if biased_col not in self._tables:
+            groups = self.df[biased_col].to_numpy()[self.test_idx]
+            self._tables[biased_col] = group_confusion_matrices(self.labels(self.test_idx), self.y_pred, groups)
+        return self._tables[biased_col]
+
+    def metrics(self, biased_col, privileged=0.5, unprivileged=0):
+        """Cached table_metrics of the confusion table of one protected column."""
+        key = (biased_col, privileged, unprivileged)
+        if key not in self._metrics:
+            values, table = self.confusion_table(biased_col)
+            self._metrics[key] = table_metrics(table, privileged, unprivileged, values)
+        return self._metrics[key]
+
+    def eod(self, biased_col, privileged=0.5, unprivileged=0):
+        return self.metrics(biased_col, privileged, unprivileged)['eod']
+
+    def aod(self, biased_col, privileged=0.5, unprivileged=0):
+        return self.metrics(biased_col, privileged, unprivileged)['aod']
+
+    def confidence_intervals(self, biased_col, n_resamples=2000, alpha=0.05, rng=None, privileged=0.5,
+                             unprivileged=0):
+        """
+        Bootstrap percentile intervals of EOD and AOD over the test rows, the model and its predictions held fixed.
+
+        :param biased_col: Protected column.
+        :param n_resamples: Number of bootstrap resamples.
+        :param alpha: 1 - confidence level.
+        :param rng: numpy Generator or seed of the resampling.
+        :return: (EOD low, EOD high), (AOD low, AOD high)
+        """
+        values, table = self.confusion_table(biased_col)
+        eod, aod = fairness_differences(bootstrap_tables(table, n_resamples, rng), values, privileged, unprivileged)
+        return percentile_interval(eod, alpha), percentile_interval(aod, alpha)
+
+    def performance(self, biased_col):
+        """
+        Accuracy, precision, recall, FAR and F1 of the test predictions.
+
+        :param biased_col: Protected column whose confusion table is pooled; every column's groups cover all test
+                           rows, so any gives the same result.
+        """
+        metrics = self.metrics(biased_col)
+        return tuple(metrics[f'overall_{name}'] for name in ('accuracy', 'precision', 'recall', 'far', 'F1'))
+
+    def awi(self, combinations):
+        """
+        Share of test rows whose prediction flips under situation testing.
+
+        :param combinations: DataFrame of protected-value combinations; its columns name the protected columns.
+        """
+        protected_idx = [self.feature_cols.get_loc(col) for col in combinations.columns]
+        flip_mask, _ = situation_test(self.model, self.features(self.test_idx), protected_idx, combinations)
+
+        total_biased_points = int(flip_mask.sum())
+        logger.info('total_biased_points: %d', total_biased_points)
+
+        # percentage of points unfairly predicted by the model
+        return total_biased_points / len(self.test_idx)
+
+    def evaluate_all(self, protected_cols, combinations=None, n_resamples=0, alpha=0.05, seed=0):
+        """
+        EOD and AOD for every protected column plus performance metrics, and AWI if combinations are given.
+
+        :param n_resamples: Bootstrap resamples of the EOD/AOD confidence intervals; 0 skips them.
+        :param alpha: 1 - confidence level of the intervals.
+        :param seed: Seed of the resampling.
+        :return: Dict keyed like EOD_derived_sex, AOD_derived_sex, ..., acc, precision, recall, far, F1, AWI, plus
+                 EOD_derived_sex_low, EOD_derived_sex_high, ... with n_resamples.
+        """
+        results = {}
+        rng = np.random.default_rng(seed)
+        for col in protected_cols:
+            results[f'EOD_{col}'] = self.eod(col)
+            results[f'AOD_{col}'] = self.aod(col)
+            if n_resamples:
+                eod_ci, aod_ci = self.confidence_intervals(col, n_resamples, alpha, rng)
+                results[f'EOD_{col}_low'], results[f'EOD_{col}_high'] = eod_ci
+                results[f'AOD_{col}_low'], results[f'AOD_{col}_high'] = aod_ci
+        results.update(zip(['acc', 'precision', 'recall', 'far', 'F1'], self.performance(protected_cols[0])))
+        if combinations is not None:
+            results['AWI'] = self.awi(combinations)
+        return results
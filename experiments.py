@@ -0,0 +1,212 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import logging
+import argparse
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline import Pipeline, model_name
+from evaluate import default_model
+from instrument import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def experiment_grid(seeds, input_file_sets, sample_sizes, targets=(None,), **options):
+    """
+    Every combination of the swept settings, as Pipeline keyword arguments.
+
+    :param seeds: Seeds of the sampling and balancing.
+    :param input_file_sets: Lists of raw input files, e.g. [[HMDA_2020, HMDA_2019], [raw_state_NV]].
+    :param sample_sizes: Numbers of rows sampled from each file.
+    :param targets: Rows per label to balance to; None is the median label count.
+    :param options: Pipeline settings shared by every run (compact, conditional_generation, ...).
+    :return: List of configuration dicts.
+    """
+    return [dict(options, input_files=list(files), sample_size=sample_size, seed=seed, target=target)
+            for files, sample_size, seed, target in product(input_file_sets, sample_sizes, seeds, targets)]
+
+
+def run_id(config):
+    """Stable identifier of a configuration, the resume key of the results file."""
+    settings = dict(config, make_model=model_name(config.get('make_model', default_model)))
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def completed_runs(result_file):
+    """run_ids already in the results file."""
+    if not os.path.exists(result_file):
+        return set()
+    with open(result_file, newline='') as f:
+        return {row['run_id'] for row in csv.DictReader(f)}
+
+
+def append_results(result_file, rows):
+    """
+    Add result rows to the CSV results file, writing the header when the file is new.
+
+    Rows replace any rows with the same run_id, so a rerun does not list a run twice. When the rows have columns the
+    file's header lacks (e.g. confidence intervals after a sweep without them), the file is rewritten with the extra
+    columns, the older rows leaving them empty, instead of dropping them.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(result_file)), exist_ok=True)
+    exists = os.path.exists(result_file) and os.path.getsize(result_file) > 0
+    fieldnames, existing = [], []
+    if exists:
+        with open(result_file, newline='') as f:
+            reader = csv.DictReader(f)
+            fieldnames, existing = list(reader.fieldnames), list(reader)
+
+    new_fields = list(dict.fromkeys(name for row in rows for name in row if name not in fieldnames))
+    run_ids = {row['run_id'] for row in rows}
+    kept = [row for row in existing if row['run_id'] not in run_ids]
+
+    if exists and (new_fields or len(kept) < len(existing)):
+        # Rewritten through a temporary file, so an interrupted rewrite leaves the old results intact
+        tmp_path = f'{result_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames + new_fields, restval='')
+            writer.writeheader()
+            writer.writerows(kept + list(rows))
+        os.replace(tmp_path, result_file)
+        return
+
+    with open(result_file, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames + new_fields, restval='')
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def result_row(config, pipeline, seconds):
+    """Settings, row counts and the initial and final metrics of a finished pipeline, as one results row."""
+    row = {'run_id': run_id(config), 'input_files': ';'.join(os.path.basename(path) for path in config['input_files']),
+           'sample_size': config['sample_size'], 'seed': config['seed'],
+           'target': 'median' if config.get('target') is None else config['target'],
+           'model': model_name(config.get('make_model', default_model)),
+           'compact': config.get('compact', False),
+           'parallel_ingest': config.get('parallel_ingest', False),
+           'planned_balancing': config.get('planned_balancing', True),
+           'pool_size': '' if config.get('pool_size') is None else config['pool_size'],
+           'conditional_generation': config.get('conditional_generation', False),
+           'mean_val': pipeline.mean_val, 'rows_processed': len(pipeline.processed),
+           'rows_balanced': len(pipeline.balanced), 'rows_removed': int(pipeline.flip_mask.sum())}
+    row.update({f'initial_{name}': value for name, value in pipeline.initial_metrics.items()})
+    row.update({f'final_{name}': value for name, value in pipeline.final_metrics.items()})
+    row['seconds'] = round(seconds, 3)
+    return row
+
+
+def prepare(config, checkpoint_dir, evaluate=False):
+    """
+    Preprocess and checkpoint the data of a configuration, and its synthetic pool if it has a pool_size, so the runs
+    sharing them only load them. With evaluate, checkpoint the initial metrics of the runs instead.
+    """
+    pipeline = Pipeline(checkpoint_dir=checkpoint_dir, with_awi=True, **config)
+    if evaluate:
+        pipeline.initial_metrics
+    elif config.get('pool_size') is None:
+        pipeline.processed
+    else:
+        pipeline.pool
+
+
+def run_experiment(config, checkpoint_dir):
+    """Run one configuration to the end; returns its results row."""
+    start = time.perf_counter()
+    pipeline = Pipeline(checkpoint_dir=checkpoint_dir, with_awi=True, **config).run()
+    return result_row(config, pipeline, time.perf_counter() - start)
+
+
+def run_experiments(configs, result_file, checkpoint_dir, n_workers=1):
+    """
+    Run configurations concurrently, appending each one's results row as soon as it finishes.
+
+    Configurations whose run_id is already in result_file are skipped, so an interrupted sweep resumes where it
+    stopped. Data shared by several runs (same files, sample size and seed) is preprocessed once, before the runs,
+    and every run reads it memory-mapped from checkpoint_dir; so is the synthetic pool of runs with a pool_size, which
+    then differ only in target, and the initial metrics of runs that also share the model and bootstrap settings.
+
+    :param configs: Pipeline keyword arguments of every run, e.g. from experiment_grid.
+    :param result_file: CSV file the results rows are appended to.
+    :param checkpoint_dir: Pipeline checkpoint directory shared by the runs.
+    :param n_workers: Number of runs executed at a time.
+    :return: Number of runs that failed.
+    """
+
+    done = completed_runs(result_file)
+    pending = [config for config in configs if run_id(config) not in done]
+    logger.info('%d runs, %d already in %s', len(configs), len(configs) - len(pending), result_file)
+
+    shared, evaluations = {}, {}
+    for config in pending:
+        data = {key: config[key] for key in ('input_files', 'sample_size', 'seed')}
+        data['compact'] = config.get('compact', False)
+        data['parallel_ingest'] = config.get('parallel_ingest', False)
+        evaluation = dict(data, **{key: config[key] for key in ('make_model', 'ind_cols', 'bootstrap_resamples')
+                                   if key in config})
+        evaluations.setdefault(run_id(evaluation), evaluation)
+        if config.get('pool_size') is not None:
+            data.update({key: config[key] for key in ('pool_size', 'conditional_generation', 'knn_algorithm')
+                         if key in config})
+        shared.setdefault(json.dumps(data, sort_keys=True), data)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # Shared checkpoints are written before the runs, so concurrent runs only read them
+        for step, prepared in (('Preprocessing', shared), ('Initial evaluation', evaluations)):
+            futures = {executor.submit(prepare, data, checkpoint_dir, step != 'Preprocessing'): data
+                       for data in prepared.values()}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    logger.error('%s of %s failed: %s', step, futures[future], future.exception())
+
+        futures = {executor.submit(run_experiment, config, checkpoint_dir): config for config in pending}
+        for future in as_completed(futures):
+            config = futures[future]
+            if future.exception() is not None:
+                failures += 1
+                logger.error('Run %s failed: %s', run_id(config), future.exception())
+                continue
+            append_results(result_file, [future.result()])
+            logger.info('Run %s finished', run_id(config))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a grid of debiasing experiments and collect their metrics.")
+    parser.add_argument('--inputs', action='append', required=True,
+                        help="comma-separated input files of one run; repeat for several file sets")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--sample-sizes', type=int, nargs='+', default=[755000])
+    parser.add_argument('--targets', nargs='+', default=['median'],
+                        help="rows per label to balance every subgroup to, or 'median'")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--results', default=os.path.join('Results', 'ALL_HMDA_results.csv'))
+    parser.add_argument('--checkpoint-dir', default=os.path.join('Data', 'cache'))
+    parser.add_argument('--compact', action='store_true', help="float32 features and an int8 label")
+    parser.add_argument('--parallel-ingest', action='store_true',
+                        help="sample and encode every input file in its own process before merging")
+    parser.add_argument('--conditional', action='store_true', help="class-conditional synthetic generation")
+    parser.add_argument('--pool', action='store_true',
+                        help="generate synthetic rows once per dataset for the largest target and serve every target "
+                             "from them")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='RESAMPLES',
+                        help="bootstrap resamples of the EOD/AOD confidence intervals (0 skips them)")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    targets = [None if target == 'median' else int(target) for target in args.targets]
+    pool_size = max([target for target in targets if target is not None], default=0) if args.pool else None
+    configs = experiment_grid(args.seeds, [files.split(',') for files in args.inputs], args.sample_sizes, targets,
+                              compact=args.compact, parallel_ingest=args.parallel_ingest,
+                              conditional_generation=args.conditional,
+                              pool_size=pool_size, bootstrap_resamples=args.bootstrap)
+    return 1 if run_experiments(configs, args.results, args.checkpoint_dir, args.workers) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
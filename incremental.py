@@ -0,0 +1,100 @@
+import os
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+from cache import load_frame
+
+
+def open_source(source, label_col='action_taken', rows=None):
+    """
+    Open an in-memory or on-disk dataset for reading by row range.
+
+    :param source: DataFrame, 2-D array with the label in the last column, or a cache entry directory written by
+                   cache.save_frame (read memory-mapped, so only the requested rows are loaded).
+    :param label_col: Label column of DataFrame and cache sources.
+    :param rows: Row positions to read, in order; all rows if omitted.
+    :return: Number of rows and a read(start, stop) function returning the (X, y) arrays of that row range.
+    """
+
+    if isinstance(source, (str, os.PathLike)):
+        path = source
+        source = load_frame(*os.path.split(os.path.normpath(path)))
+        if source is None:
+            raise FileNotFoundError(f"No cached dataset in {path}")
+
+    selection = slice if rows is None else (lambda start, stop: rows[start:stop])
+
+    if hasattr(source, 'columns'):
+        feature_idx = np.flatnonzero(source.columns != label_col)
+        label_idx = source.columns.get_loc(label_col)
+
+        def read(start, stop):
+            chunk = source.iloc[selection(start, stop)]
+            return chunk.iloc[:, feature_idx].to_numpy(), chunk.iloc[:, label_idx].to_numpy()
+    else:
+        def read(start, stop):
+            chunk = np.asarray(source[selection(start, stop)])
+            return chunk[:, :-1], chunk[:, -1]
+
+    return len(source) if rows is None else len(rows), read
+
+
+class IncrementalLogisticRegression:
+    def __init__(self, chunk_size=100_000, epochs=5, alpha=1e-4, random_state=0):
+        """
+        Logistic regression trained chunk by chunk with SGD, so memory stays flat in the number of rows.
+
+        Exposes coef_, intercept_, classes_ and predict like LogisticRegression, so it works with
+        EvaluationSession and with the closed-form path of situation_test.
+
+        :param chunk_size: Number of rows per partial_fit call.
+        :param epochs: Number of passes over the data.
+        :param alpha: L2 regularization strength.
+        :param random_state: Seed of the SGD updates and of the chunk order.
+        """
+        self.chunk_size = chunk_size
+        self.epochs = epochs
+        self.alpha = alpha
+        self.random_state = random_state
+        self.model = None
+
+    def _fit_reader(self, n_rows, read):
+        # A fresh model and chunk order on every fit, so refitting gives the same model
+        rng = np.random.default_rng(self.random_state)
+        self.model = SGDClassifier(loss='log_loss', penalty='l2', alpha=self.alpha, random_state=self.random_state)
+        starts = np.arange(0, n_rows, self.chunk_size)
+        for _ in range(self.epochs):
+            for start in rng.permutation(starts):
+                X, y = read(start, start + self.chunk_size)
+                self.model.partial_fit(X, y, classes=np.array([0.0, 1.0]))
+        return self
+
+    def fit(self, X, y):
+        """Fit on in-memory data, one chunk_size slice at a time."""
+        X, y = np.asarray(X), np.asarray(y)
+        return self._fit_reader(len(X), lambda start, stop: (X[start:stop], y[start:stop]))
+
+    def fit_source(self, source, label_col='action_taken', rows=None):
+        """Fit by streaming any open_source source, reading each chunk only when it is used."""
+        return self._fit_reader(*open_source(source, label_col, rows))
+
+    @property
+    def coef_(self):
+        return self.model.coef_
+
+    @property
+    def intercept_(self):
+        return self.model.intercept_
+
+    @property
+    def classes_(self):
+        return self.model.classes_
+
+    def decision_function(self, X):
+        return self.model.decision_function(np.asarray(X))
+
+    def predict(self, X):
+        return self.model.predict(np.asarray(X))
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(np.asarray(X))
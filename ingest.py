@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sklearn.preprocessing import MinMaxScaler
+from constant import column_labels, categorical_columns
+from preprocess import encode_dataset, dataset_frame
+
+
+def column_dtypes(usecols=column_labels):
+    """Explicit read dtypes: categorical codes for the string-valued columns, float64 for everything else."""
+    return {c: 'category' if c in categorical_columns else np.float64 for c in usecols}
+
+
+def concat_frames(frames):
+    """Concatenate frames, unioning the categories of categorical columns so they stay categorical."""
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    columns = {}
+    for c in frames[0].columns:
+        if isinstance(frames[0][c].dtype, pd.CategoricalDtype):
+            columns[c] = pd.Series(union_categoricals([f[c] for f in frames], sort_categories=True))
+        else:
+            columns[c] = pd.Series(np.concatenate([f[c].to_numpy() for f in frames]))
+    return pd.DataFrame(columns)
+
+
+def read_sample(path, n, rng=None, usecols=column_labels, chunksize=250_000):
+    """
+    Draw a uniform random sample of rows from a CSV without loading the whole file.
+
+    The file is parsed in chunks, only usecols are read, and every row gets a random key; the n rows with the smallest
+    keys seen so far form the reservoir, so memory scales with n plus one chunk. Values that cannot be parsed as
+    numbers ("Exempt") are read as missing and dropped later by preprocessing.
+
+    :param path: CSV file to read.
+    :param n: Number of rows to sample.
+    :param rng: numpy.random.Generator or seed, for a reproducible sample.
+    :param usecols: Columns to read.
+    :param chunksize: Number of rows parsed per chunk.
+    :return: DataFrame with n rows in random order.
+    """
+
+    rng = np.random.default_rng(rng)
+    pieces, keys = [], []
+
+    reader = pd.read_csv(path, usecols=usecols, dtype=column_dtypes(usecols), na_values=['Exempt'],
+                         chunksize=chunksize)
+    for chunk in reader:
+        pieces.append(chunk)
+        keys.append(rng.random(len(chunk)))
+
+        all_keys = np.concatenate(keys)
+        if len(all_keys) > n:
+            threshold = np.partition(all_keys, n - 1)[n - 1]
+            pieces = [p[k <= threshold] for p, k in zip(pieces, keys)]
+            keys = [k[k <= threshold] for k in keys]
+
+    total = sum(len(p) for p in pieces)
+    if total < n:
+        raise ValueError(f"Cannot take a sample of {n} rows from {path} with {total} rows")
+
+    sample = concat_frames(pieces)[list(usecols)]
+    return sample.iloc[np.argsort(np.concatenate(keys), kind='stable')].reset_index(drop=True)
+
+
+def encode_file(path, n, seed, compact=False):
+    """
+    Sample and encode one raw file, the per-file worker step of preprocess_files.
+
+    :param path: CSV file to read.
+    :param n: Number of rows to sample.
+    :param seed: Seed (or numpy.random.SeedSequence) of the sample.
+    :param compact: Build a float32 matrix.
+    :return: Unscaled matrix and loan product types from encode_dataset, and the column minima and maxima of the
+             matrix (NaN if it has no rows).
+    """
+
+    values, product_types = encode_dataset(read_sample(path, n, rng=np.random.default_rng(seed)), compact)
+    if not len(values):
+        return values, product_types, np.full(values.shape[1], np.nan), np.full(values.shape[1], np.nan)
+    return values, product_types, values.min(axis=0), values.max(axis=0)
+
+
+def preprocess_files(input_files, n, seed=0, n_workers=1, compact=False):
+    """
+    Sample, encode and scale several raw files (yearly or state files) in parallel, one worker process per file.
+
+    Every worker reads, filters and encodes its own file, so at most one raw file per worker is in memory and only
+    the encoded matrices reach this process. Their loan product type codes are mapped onto the union of all files'
+    product types, sorted as preprocessing codes a single frame, and a single MinMaxScaler is fitted on the merged
+    column minima and maxima, which gives the scaling of a fit on all rows. The merged rows are shuffled.
+
+    The result has the layout of preprocessing's, but every file is sampled with its own seed spawned from seed, so
+    the rows differ from those of sampling the files one after another.
+
+    :param input_files: Raw HMDA CSV files.
+    :param n: Number of rows sampled from each file.
+    :param seed: Seed of the samples and of the row order.
+    :param n_workers: Number of worker processes; 1 encodes the files in this process.
+    :param compact: Store float32 features and an int8 label (see preprocessing).
+    :return: Scaled DataFrame with column_labels columns.
+    """
+
+    seeds = np.random.SeedSequence(seed).spawn(len(input_files) + 1)
+    args = (input_files, [n] * len(input_files), seeds[:-1], [compact] * len(input_files))
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(input_files))) as executor:
+            results = list(executor.map(encode_file, *args))
+    else:
+        results = list(map(encode_file, *args))
+    partitions, product_types, minima, maxima = (list(part) for part in zip(*results))
+
+    j = column_labels.index('derived_loan_product_type')
+    all_product_types = np.array(sorted(set().union(*product_types)), dtype=object)
+    for i, partition in enumerate(partitions):
+        if len(partition):
+            codes = np.searchsorted(all_product_types, np.array(product_types[i], dtype=object))
+            partition[:, j] = codes[partition[:, j].astype(np.intp)]
+            minima[i][j], maxima[i][j] = partition[:, j].min(), partition[:, j].max()
+
+    # Fitting on the per-file minima and maxima only; MinMaxScaler ignores the NaN rows of empty files
+    scaler = MinMaxScaler(copy=False).fit(np.vstack(minima + maxima))
+
+    # Each partition is scattered straight into its shuffled rows of one column-major matrix and released
+    bounds = np.cumsum([0] + [len(partition) for partition in partitions])
+    destination = np.random.default_rng(seeds[-1]).permutation(bounds[-1])
+    values = np.empty((bounds[-1], len(column_labels)), dtype=np.float32 if compact else float, order='F')
+    for i in range(len(partitions)):
+        values[destination[bounds[i]:bounds[i + 1]]] = partitions[i]
+        partitions[i] = None
+
+    return dataset_frame(scaler.transform(values), compact)
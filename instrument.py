@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import logging
+import contextlib
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(level=logging.INFO):
+    """Send log records of the pipeline modules to stderr at the given level (logging.WARNING keeps it quiet)."""
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger().setLevel(level)
+
+
+class RunReport:
+    def __init__(self, track_memory=False, **meta):
+        """
+        Collect per-stage timings, peak memory, row counts and counters of one run.
+
+        :param track_memory: Trace allocations to record each stage's peak memory (slows allocation-heavy stages).
+        :param meta: Run settings stored with the report.
+        """
+        self.track_memory = track_memory
+        self.meta = meta
+        self.stages = []
+        self.counters = Counter()
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Time a (non-nested) stage. The yielded record takes extra fields, e.g. record['rows_out'] = len(out).
+
+        :param name: Stage name.
+        :param rows_in: Number of input rows, for the throughput figure.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        started_tracing = self.track_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.track_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            # Without tracking there is no measurement, so the record has no peak_bytes rather than a misleading one
+            if self.track_memory:
+                record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            record['rows_per_second'] = rows_in / record['seconds'] if rows_in and record['seconds'] else None
+            self.stages.append(record)
+            logger.info('%s: %.3f s, rows %s -> %s%s', name, record['seconds'], rows_in, record['rows_out'],
+                        f", peak {record['peak_bytes'] / 2 ** 20:.1f} MiB" if self.track_memory else '')
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def to_dict(self):
+        return {'started': self.started, 'seconds': time.perf_counter() - self._start, 'meta': self.meta,
+                'stages': self.stages, 'counters': dict(self.counters)}
+
+    def write(self, path):
+        """Write the report as JSON."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
@@ -0,0 +1,64 @@
+import os
+import hashlib
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+
+def graph_key(data, k, p=2, algorithm='auto'):
+    """Fingerprint of the k-nearest-neighbor graph of data: its contents, shape and dtype plus the kNN settings."""
+    data = np.ascontiguousarray(data)
+    digest = hashlib.sha256(data.view(np.uint8).ravel() if data.size else b'')
+    digest.update(repr((data.shape, str(data.dtype), k, 'minkowski', p, algorithm)).encode())
+    return digest.hexdigest()
+
+
+class NeighborIndex:
+    def __init__(self, data, k, p=2, algorithm='auto', cache_dir=None):
+        """
+        Nearest neighbors of rows of data, optionally from a neighbor graph cached on disk.
+
+        Without a cache_dir, every neighbors() call queries a NearestNeighbors index fitted on data. With one, the
+        k nearest neighbors of every row are computed once, stored as <cache_dir>/<graph_key>.npy and afterwards
+        only memory-mapped, so repeated runs over the same rows skip building and querying the index. Both give
+        the same neighbors, since a row's neighbors do not depend on which other rows are queried.
+
+        :param data: 2-D array of the rows to search.
+        :param k: Number of neighbors per row, the row itself included (capped at the number of rows).
+        :param p: Minkowski metric power, 2 for Euclidean distance.
+        :param algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+        :param cache_dir: Directory of cached neighbor graphs; None queries the index directly.
+        """
+        self.data = data
+        self.k = min(k, len(data))
+        self.p = p
+        self.algorithm = algorithm
+        self.cache_dir = cache_dir
+        self._knn = None
+        self._graph = None
+
+    @property
+    def knn(self):
+        if self._knn is None:
+            self._knn = NearestNeighbors(n_neighbors=self.k, p=self.p, algorithm=self.algorithm).fit(self.data)
+        return self._knn
+
+    @property
+    def graph(self):
+        """(rows, k) array of neighbor positions of every row, nearest first, memory-mapped from the cache."""
+        if self._graph is None:
+            path = os.path.join(self.cache_dir, graph_key(self.data, self.k, self.p, self.algorithm) + '.npy')
+            if not os.path.exists(path):
+                graph = self.knn.kneighbors(self.data, return_distance=False)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Unique temporary name, so parallel workers building the same graph do not collide
+                tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+                np.save(tmp_path, graph.astype(np.int32 if len(self.data) < 2 ** 31 else np.int64))
+                os.replace(tmp_path, path)
+            self._graph = np.load(path, mmap_mode='r')
+        return self._graph
+
+    def neighbors(self, idx):
+        """Neighbor positions (len(idx) x k, nearest first) of the rows at positions idx."""
+        if self.cache_dir is None:
+            return self.knn.kneighbors(self.data[idx], return_distance=False)
+        return np.asarray(self.graph[idx], dtype=np.intp)
@@ -0,0 +1,49 @@
+import os
+import bz2
+import gzip
+import lzma
+
+# Stream openers for compressed CSV output, by file extension
+csv_openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def write_frame(df, path, chunk_size=250_000, index=False, mask=None):
+    """
+    Write a frame to disk in chunks, so peak memory during output stays flat in the number of rows.
+
+    The format follows the file name: '.parquet' writes compressed Parquet (needs pyarrow), anything else writes CSV,
+    compressed according to its extension ('.csv.gz', '.csv.bz2' or '.csv.xz').
+
+    :param df: Frame to write.
+    :param path: Output file.
+    :param chunk_size: Number of rows serialized at a time.
+    :param index: Whether to write the index.
+    :param mask: Boolean array selecting the rows to write, applied chunk by chunk so the selection is never copied
+                 as a whole; all rows if omitted.
+    """
+
+    def chunks():
+        for start in range(0, max(len(df), 1), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            yield chunk if mask is None else chunk[mask[start:start + chunk_size]]
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet output requires pyarrow; use a .csv or .csv.gz file name instead")
+
+        schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=index)
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for chunk in chunks():
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=index))
+        return
+
+    # Chunks are appended to one stream, so a compressed CSV stays a single compressed file
+    opener = csv_openers.get(os.path.splitext(path)[1], open)
+    with opener(path, 'wt', newline='') as f:
+        for i, chunk in enumerate(chunks()):
+            chunk.to_csv(f, header=i == 0, index=index)
@@ -0,0 +1,311 @@
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+
+from evaluate import EvaluationSession, default_model
+from constant import column_labels, categorical_columns, code_maps
+from situation_testing import situation_test
+from ingest import read_sample, concat_frames, preprocess_files
+from preprocess import preprocessing, split_features
+from cache import cache_key, derive_key, load_frame, save_frame, load_record, save_record
+from subgroups import SubgroupIndex
+from balancing import apply_balancing, plan_and_balance
+from pool import SyntheticPool
+from output import write_frame
+from instrument import RunReport
+
+logger = logging.getLogger(__name__)
+
+protected_columns = ['derived_ethnicity', 'derived_race', 'derived_sex']
+
+
+def load_dataset(input_files, sample_size, seed):
+    sample_rng = np.random.default_rng(seed)
+    dataset_orig = concat_frames([read_sample(path, sample_size, rng=sample_rng) for path in input_files])
+    dataset_orig = dataset_orig.sample(frac=1, random_state=seed)
+    dataset_orig.reset_index(drop=True, inplace=True)
+
+    action_taken_col = dataset_orig.pop('action_taken')
+    dataset_orig.insert(len(dataset_orig.columns), 'action_taken', action_taken_col)
+    return dataset_orig
+
+
+def model_name(make_model):
+    """Stable name of a model factory, for checkpoint keys."""
+    return f"{getattr(make_model, '__module__', '')}.{getattr(make_model, '__qualname__', repr(make_model))}"
+
+
+class Pipeline:
+    stages = ('load', 'preprocess', 'partition', 'balance', 'situation_test', 'evaluate')
+    stage_outputs = {'load': 'raw', 'preprocess': 'processed', 'partition': 'subgroups', 'balance': 'balanced',
+                     'situation_test': 'flip_mask'}
+
+    def __init__(self, input_files, sample_size=755000, seed=0, target=None, ind_cols=protected_columns, n_workers=1,
+                 make_model=default_model, compact=False, parallel_ingest=False, planned_balancing=True, pool_size=None,
+                 conditional_generation=False, knn_algorithm='auto', with_awi=False, bootstrap_resamples=0,
+                 checkpoint_dir=None, report=None):
+        """
+        Fair-SMOTE + RUS debiasing of the HMDA data as lazily evaluated stages.
+
+        Nothing runs when the pipeline is created. Reading a stage output (raw, processed, subgroups, balanced,
+        flip_mask, initial_metrics, final_metrics) runs that stage and whatever it needs that has not run yet.
+        With a checkpoint_dir, the outputs of preprocess, pool, balance, situation_test and evaluate are stored there,
+        keyed by the input file contents and every setting they depend on, so a rerun resumes after the last stored
+        stage. load and partition are not stored: load only runs when preprocess has no checkpoint, and partition
+        takes milliseconds.
+
+        :param input_files: Raw HMDA CSV files.
+        :param sample_size: Number of rows sampled from each file.
+        :param seed: Seed of the sampling and of the balancing.
+        :param target: Number of rows per label every subgroup is balanced to; None uses the median label count.
+        :param ind_cols: Protected columns defining the subgroups.
+        :param n_workers: Number of processes ingesting files (with parallel_ingest), balancing subgroups and
+                          situation-testing non-linear models (the output does not depend on it).
+        :param make_model: Zero-argument factory of the classifier used for situation testing and evaluation.
+        :param compact: Keep the processed data as float32 features and an int8 label (see preprocessing).
+        :param parallel_ingest: Sample, encode and scale the input files in n_workers processes, one file each, with
+                                ingest.preprocess_files instead of preprocessing their concatenated raw rows; the
+                                sampled rows differ.
+        :param planned_balancing: Balance with balancing.plan_and_balance (one selection pass and one gather)
+                                  instead of balancing.apply_balancing (per-subgroup frames); same label counts.
+        :param pool_size: Balance from a SyntheticPool serving every target up to max(pool_size, median label count),
+                          checkpointed once, so runs differing only in target do not generate rows again; None
+                          balances for the one target. The pool balances each label on its own: labels above the
+                          target are undersampled and labels below it are topped up with generated rows only, so
+                          subgroups below the target get no SMOTE rows and the result differs from the other
+                          balancers'.
+        :param conditional_generation: Generate each label's synthetic rows from that label's rows only, so every
+                                       candidate is kept (see sampling.generate_samples_conditional).
+        :param knn_algorithm: NearestNeighbors backend of the oversampling: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+        :param with_awi: Also measure AWI in the evaluate stage.
+        :param bootstrap_resamples: Bootstrap resamples of the EOD/AOD confidence intervals of the evaluate stage; 0
+                                    skips them.
+        :param checkpoint_dir: Directory stage outputs are stored in, with the subgroup neighbor graphs under knn/;
+                               None disables checkpoints.
+        :param report: RunReport the stages are timed in; a new one if omitted.
+        """
+        self.input_files = list(input_files)
+        self.sample_size = sample_size
+        self.seed = seed
+        self.target = target
+        self.ind_cols = list(ind_cols)
+        self.n_workers = n_workers
+        self.make_model = make_model
+        self.compact = compact
+        self.parallel_ingest = parallel_ingest
+        self.planned_balancing = planned_balancing
+        self.pool_size = pool_size
+        self.conditional_generation = conditional_generation
+        self.knn_algorithm = knn_algorithm
+        self.with_awi = with_awi
+        self.bootstrap_resamples = bootstrap_resamples
+        self.checkpoint_dir = checkpoint_dir
+        self.report = RunReport(input_files=self.input_files, sample_size=sample_size, seed=seed,
+                                n_workers=n_workers) if report is None else report
+        self._outputs = {}
+        self._keys = {}
+
+    def key(self, stage):
+        """Checkpoint key of a stage output; hashing the input files happens on first use."""
+        if stage not in self._keys:
+            model = model_name(self.make_model)
+            if stage == 'preprocess':
+                key = cache_key(self.input_files, sample_size=self.sample_size, seed=self.seed,
+                                column_labels=column_labels, categorical_columns=categorical_columns,
+                                code_maps=code_maps, compact=self.compact, parallel_ingest=self.parallel_ingest)
+            elif stage == 'pool':
+                key = derive_key(self.key('preprocess'), stage, ind_cols=self.ind_cols, seed=self.seed,
+                                 size=self.pool_target, conditional_generation=self.conditional_generation,
+                                 knn_algorithm=self.knn_algorithm)
+            elif stage == 'balance' and self.pool_size is not None:
+                key = derive_key(self.key('pool'), stage, target=self.target)
+            elif stage == 'balance':
+                key = derive_key(self.key('preprocess'), stage, ind_cols=self.ind_cols, seed=self.seed,
+                                 target=self.target, planned_balancing=self.planned_balancing,
+                                 conditional_generation=self.conditional_generation,
+                                 knn_algorithm=self.knn_algorithm)
+            elif stage == 'situation_test':
+                key = derive_key(self.key('balance'), stage, model=model)
+            elif stage == 'evaluate_initial':
+                key = derive_key(self.key('preprocess'), stage, model=model, ind_cols=self.ind_cols,
+                                 with_awi=self.with_awi, bootstrap_resamples=self.bootstrap_resamples)
+            elif stage == 'evaluate_final':
+                key = derive_key(self.key('situation_test'), stage, ind_cols=self.ind_cols, with_awi=self.with_awi,
+                                 bootstrap_resamples=self.bootstrap_resamples)
+            else:
+                raise ValueError(f"Stage {stage!r} has no checkpoint")
+            self._keys[stage] = key
+        return self._keys[stage]
+
+    def _run(self, stage, build, needs=(), load=None, save=None):
+        """
+        Return a stage output, from memory, from its checkpoint or by running build().
+
+        :param stage: Stage name.
+        :param build: Function computing the output from the outputs named in needs.
+        :param needs: Names of the stage outputs build takes; they are resolved before the stage is timed.
+        :param load: load(checkpoint_dir, key) returning the stored output or None; None if never stored.
+        :param save: save(output, checkpoint_dir, key).
+        """
+        if stage in self._outputs:
+            return self._outputs[stage]
+
+        output = None
+        if self.checkpoint_dir is not None and load is not None:
+            output = load(self.checkpoint_dir, self.key(stage))
+            if output is not None:
+                logger.info('%s: resumed from checkpoint %s', stage, self.key(stage))
+
+        if output is None:
+            inputs = [getattr(self, name) for name in needs]
+            rows_in = None if not inputs else len(getattr(inputs[0], 'df', inputs[0]))
+            with self.report.stage(stage, rows_in) as record:
+                output = build(*inputs)
+                record['rows_out'] = len(output) if hasattr(output, 'shape') else None
+            if self.checkpoint_dir is not None and save is not None:
+                save(output, self.checkpoint_dir, self.key(stage))
+                # Reload so the output is memory-mapped like a resumed one
+                output = load(self.checkpoint_dir, self.key(stage))
+
+        self._outputs[stage] = output
+        return output
+
+    @property
+    def raw(self):
+        """Sampled, shuffled raw rows of every input file."""
+        return self._run('load', lambda: load_dataset(self.input_files, self.sample_size, self.seed))
+
+    @property
+    def processed(self):
+        """Encoded and min-max scaled dataset."""
+        if self.parallel_ingest:
+            return self._run('preprocess', lambda: preprocess_files(self.input_files, self.sample_size, self.seed,
+                                                                    self.n_workers, self.compact),
+                             load=load_frame, save=save_frame)
+        return self._run('preprocess', lambda raw: preprocessing(raw, self.compact), ['raw'], load=load_frame,
+                         save=save_frame)
+
+    @property
+    def subgroups(self):
+        """SubgroupIndex of the processed dataset over ind_cols."""
+        return self._run('partition', lambda df: SubgroupIndex(df, self.ind_cols), ['processed'])
+
+    @property
+    def combinations(self):
+        """Every combination of the protected values, as situation testing substitutes them."""
+        return self.subgroups.unique_df
+
+    @property
+    def mean_val(self):
+        """Number of rows per label every subgroup is balanced to."""
+        return self.subgroups.median_target() if self.target is None else self.target
+
+    @property
+    def knn_cache_dir(self):
+        """Directory of the cached subgroup neighbor graphs, None without checkpoints."""
+        return None if self.checkpoint_dir is None else os.path.join(self.checkpoint_dir, 'knn')
+
+    @property
+    def pool_target(self):
+        """Largest target the synthetic pool serves."""
+        return max(self.pool_size, self.subgroups.median_target())
+
+    @property
+    def pool(self):
+        """SyntheticPool of the processed dataset, sized to pool_target."""
+        def build(subgroups):
+            return SyntheticPool.build(subgroups, self.pool_target, seed=self.seed, n_workers=self.n_workers,
+                                       conditional=self.conditional_generation, knn_cache_dir=self.knn_cache_dir,
+                                       knn_algorithm=self.knn_algorithm)
+        return self._run('pool', build, ['subgroups'],
+                         load=lambda cache_dir, key: SyntheticPool.load(self.processed, cache_dir, key),
+                         save=lambda pool, cache_dir, key: pool.save(cache_dir, key))
+
+    @property
+    def balanced(self):
+        """Every subgroup balanced to the median label count with RUS or synthetic samples."""
+        if self.pool_size is not None:
+            return self._run('balance', lambda pool: pool.balance(self.mean_val), ['pool'], load=load_frame,
+                             save=save_frame)
+
+        def build(subgroups):
+            balance = plan_and_balance if self.planned_balancing else apply_balancing
+            return balance(subgroups, self.mean_val, seed=self.seed, n_workers=self.n_workers,
+                           conditional=self.conditional_generation, knn_cache_dir=self.knn_cache_dir,
+                           knn_algorithm=self.knn_algorithm)
+        return self._run('balance', build, ['subgroups'], load=load_frame, save=save_frame)
+
+    @property
+    def flip_mask(self):
+        """Rows of balanced whose prediction changes under some protected-value combination."""
+        def build(df, combinations):
+            X_train, y_train = split_features(df)
+            clf = self.make_model()
+            clf.fit(X_train, y_train)
+
+            feature_cols = df.columns[df.columns != 'action_taken']
+            protected_idx = [feature_cols.get_loc(col) for col in self.ind_cols]
+            flip_mask, _ = situation_test(clf, X_train, protected_idx, combinations, n_workers=self.n_workers)
+            self.report.count('situation_test_evaluations', len(df) * len(combinations))
+            return pd.DataFrame({'flipped': flip_mask})
+
+        flipped = self._run('situation_test', build, ['balanced', 'combinations'], load=load_frame, save=save_frame)
+        return flipped['flipped'].to_numpy(dtype=bool)
+
+    @property
+    def removed(self):
+        """Balanced rows removed by situation testing."""
+        return self.balanced[self.flip_mask]
+
+    @property
+    def debiased(self):
+        """Balanced rows kept by situation testing, the final dataset."""
+        return self.balanced[~self.flip_mask]
+
+    def _evaluate(self, stage, dataset):
+        def build(df, *combinations):
+            session = EvaluationSession(df, make_model=self.make_model)
+            results = session.evaluate_all(self.ind_cols, *combinations, n_resamples=self.bootstrap_resamples,
+                                           seed=self.seed)
+            return {name: float(value) for name, value in results.items()}
+        needs = [dataset, 'combinations'] if self.with_awi else [dataset]
+        return self._run(stage, build, needs, load=load_record, save=save_record)
+
+    @property
+    def initial_metrics(self):
+        """
+        EOD and AOD per protected column, performance metrics and optionally AWI and the EOD/AOD bootstrap confidence
+        intervals of the processed dataset.
+        """
+        return self._evaluate('evaluate_initial', 'processed')
+
+    @property
+    def final_metrics(self):
+        """The initial_metrics measures, on the debiased dataset."""
+        return self._evaluate('evaluate_final', 'debiased')
+
+    def run(self, until='evaluate'):
+        """
+        Run every stage up to and including until; stages already in memory or checkpointed are not rerun.
+
+        :param until: Last stage to run, one of Pipeline.stages.
+        :return: self
+        """
+        if until not in self.stages:
+            raise ValueError(f"Unknown stage {until!r}; expected one of {self.stages}")
+        if until == 'evaluate':
+            self.initial_metrics, self.final_metrics
+        else:
+            getattr(self, self.stage_outputs[until])
+        return self
+
+    def write_outputs(self, balanced_file, removed_file, final_file):
+        """Write the balanced dataset, the rows removed by situation testing and the final debiased dataset."""
+        with self.report.stage('write_outputs', len(self.balanced)):
+            write_frame(self.balanced, balanced_file)
+            self.report.count('rows_removed', int(self.flip_mask.sum()))
+            # Masked chunk by chunk, so neither subset of the balanced rows is copied as a whole
+            write_frame(self.balanced, removed_file, index=True, mask=self.flip_mask)
+            write_frame(self.balanced, final_file, index=True, mask=~self.flip_mask)
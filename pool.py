@@ -0,0 +1,159 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from balancing import shuffle_cells, cell_prefixes, assemble
+from sampling import generate_samples_batched, generate_samples_conditional
+from cache import load_frame, save_frame
+
+logger = logging.getLogger(__name__)
+
+
+def generate_pool(c, n_zeros, n_ones, seed, conditional=False, knn_cache_dir=None, knn_algorithm='auto'):
+    """
+    Synthetic rows of each label of one subgroup, in generation order.
+
+    Candidates are drawn independently of each other, so the first k rows of a label are distributed like k rows
+    generated on their own; smaller targets can use prefixes of the pool.
+
+    :param c: Rows of the subgroup.
+    :param n_zeros: Number of rows with label 0.
+    :param n_ones: Number of rows with label 1.
+    :param seed: Seed (or numpy.random.SeedSequence) of this subgroup's generation.
+    :param conditional: Use class-conditional generation (see balancing.balance_subgroup).
+    :param knn_cache_dir: Directory of cached neighbor graphs (see neighbors.NeighborIndex), or None.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: DataFrames of the label 0 and label 1 rows, with the columns of c.
+    """
+
+    generate = generate_samples_conditional if conditional else generate_samples_batched
+    df_zeros, df_ones = generate(n_zeros, n_ones, c, 'HMDA', rng=np.random.default_rng(seed),
+                                 knn_cache_dir=knn_cache_dir, knn_algorithm=knn_algorithm)
+    df_zeros.columns, df_ones.columns = c.columns, c.columns
+    return df_zeros, df_ones
+
+
+class SyntheticPool:
+    def __init__(self, df, positions, cells, synthetic, synthetic_cells, n_cells, size, shuffle_seed):
+        """
+        Synthetic rows and an undersampling permutation that balance a dataset to any target up to size.
+
+        Cells are (subgroup, label) pairs numbered 2 * subgroup + label. Balancing to a target keeps the first
+        target real rows of every cell in the stored permutation and fills cells with fewer rows from the start of
+        their synthetic rows, so no target generates or draws anything again. Use SyntheticPool.build.
+
+        :param df: Dataset the pool was built from.
+        :param positions: Row positions of df sorted by cell, in random order within each cell.
+        :param cells: Cell of each of positions.
+        :param synthetic: Synthetic rows sorted by cell, in generation order within each cell.
+        :param synthetic_cells: Cell of each synthetic row.
+        :param n_cells: Number of cells, twice the number of subgroups.
+        :param size: Largest target the pool serves.
+        :param shuffle_seed: Seed of the row order of balanced datasets.
+        """
+        self.df = df
+        self.positions = positions
+        self.cells = cells
+        self.synthetic = synthetic
+        self.synthetic_cells = synthetic_cells
+        self.n_cells = n_cells
+        self.size = size
+        self.shuffle_seed = shuffle_seed
+
+    @classmethod
+    def build(cls, subgroup_index, size, seed=0, n_workers=1, conditional=False, knn_cache_dir=None,
+              knn_algorithm='auto'):
+        """
+        Shuffle the rows of every cell and generate the synthetic rows every target up to size needs.
+
+        Every subgroup is generated with its own seed spawned from the master seed, so the pool is identical for any
+        n_workers. Unlike plan_and_balance, which picks SMOTE, undersampling or generation per subgroup for one
+        target, each label is undersampled or topped up on its own, so that every target takes prefixes of the
+        same rows; in particular subgroups below size on both labels are topped up by generation alone, without the
+        SMOTE step of the other balancers. Subgroups without rows are left out, and a label without rows in an
+        otherwise populated subgroup gets no synthetic rows (with a warning), since nothing can be generated from it.
+
+        :param subgroup_index: SubgroupIndex of the dataset.
+        :param size: Largest target number of rows per label.
+        :param seed: Master seed.
+        :param n_workers: Number of worker processes generating rows; 1 generates in this process.
+        :param conditional: Use class-conditional generation (see balancing.balance_subgroup).
+        :param knn_cache_dir: Directory of cached neighbor graphs, or None.
+        :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+        """
+
+        seeds = np.random.SeedSequence(seed).spawn(len(subgroup_index) + 2)
+        positions, cells = shuffle_cells(subgroup_index, np.random.default_rng(seeds[-2]))
+
+        counts = np.column_stack([subgroup_index.neg_counts, subgroup_index.pos_counts])
+        missing = np.maximum(size - counts, 0)
+        empty = (counts == 0) & (counts.sum(axis=1, keepdims=True) > 0)
+        if empty.any():
+            logger.warning('%d subgroup labels have no rows to generate from; they stay short of every target',
+                           empty.sum())
+        missing[counts == 0] = 0
+        todo = np.flatnonzero(missing.any(axis=1))
+        logger.debug('Generating %d rows for %d subgroups', missing[todo].sum(), len(todo))
+
+        df = subgroup_index.df
+        args = ([df.iloc[subgroup_index.positions(i)] for i in todo], missing[todo, 0], missing[todo, 1],
+                [seeds[i] for i in todo], [conditional] * len(todo), [knn_cache_dir] * len(todo),
+                [knn_algorithm] * len(todo))
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(generate_pool, *args))
+        else:
+            results = list(map(generate_pool, *args))
+
+        frames = [frame for pair in results for frame in pair]
+        synthetic_cells = np.repeat(np.column_stack([2 * todo, 2 * todo + 1]).ravel(),
+                                    [len(frame) for frame in frames]).astype(np.int64)
+        # Generated rows come out of the arithmetic as float64; keep the dtypes of the input (e.g. compact ones)
+        synthetic = pd.concat(frames or [df.iloc[:0]], ignore_index=True).astype(df.dtypes.to_dict())
+        shuffle_seed = int(seeds[-1].generate_state(1)[0])
+        return cls(df, positions, cells, synthetic, synthetic_cells, 2 * len(subgroup_index), size, shuffle_seed)
+
+    def balance(self, target):
+        """
+        Balanced dataset with target rows per label in every subgroup, in random order.
+
+        :param target: Number of rows per label, at most size.
+        :return: Balanced DataFrame.
+        """
+
+        if target > self.size:
+            raise ValueError(f"The pool serves targets up to {self.size}, not {target}")
+        counts = np.bincount(self.cells, minlength=self.n_cells)
+        kept = self.positions[cell_prefixes(self.cells, np.full(self.n_cells, target))]
+        synthetic = self.synthetic.iloc[cell_prefixes(self.synthetic_cells, np.maximum(target - counts, 0))]
+        return assemble(self.df, kept, [synthetic], np.random.default_rng(self.shuffle_seed))
+
+    def save(self, cache_dir, key):
+        """Store the pool as <cache_dir>/<key>: the synthetic rows with save_frame plus the permutation."""
+        entry = os.path.join(cache_dir, key)
+        os.makedirs(entry, exist_ok=True)
+        # Unique temporary name, so concurrent runs saving the same pool do not collide
+        tmp_path = os.path.join(entry, f'pool.npz.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, positions=self.positions, cells=self.cells, synthetic_cells=self.synthetic_cells,
+                 meta=np.array([self.n_cells, self.size, self.shuffle_seed]))
+        os.replace(tmp_path, os.path.join(entry, 'pool.npz'))
+        # save_frame writes its schema last, which marks the entry as complete
+        save_frame(self.synthetic, cache_dir, key)
+
+    @classmethod
+    def load(cls, df, cache_dir, key):
+        """
+        Load a stored pool of df, its synthetic rows memory-mapped.
+
+        :return: SyntheticPool, or None on a cache miss.
+        """
+        synthetic = load_frame(cache_dir, key)
+        if synthetic is None:
+            return None
+        with np.load(os.path.join(cache_dir, key, 'pool.npz')) as arrays:
+            n_cells, size, shuffle_seed = (int(value) for value in arrays['meta'])
+            return cls(df, arrays['positions'], arrays['cells'], synthetic, arrays['synthetic_cells'], n_cells, size,
+                       shuffle_seed)
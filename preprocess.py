@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+from constant import column_labels, code_maps
+
+
+#####------------------Scaling------------------------------------
+def scale_dataset(processed_df):
+    scaler = MinMaxScaler()
+    scaled_df = pd.DataFrame(scaler.fit_transform(processed_df), columns=processed_df.columns)
+    return scaled_df
+
+
+def encode_column(column, codes):
+    """Map a string column to its integer codes through its categories; values without a code become NaN."""
+    categorical = column.astype('category')
+    lookup = np.array([codes.get(c, np.nan) for c in categorical.cat.categories] + [np.nan])
+    # Missing values have code -1, which picks the trailing NaN
+    return lookup[categorical.cat.codes.to_numpy()]
+
+
+def split_features(df, label_col='action_taken'):
+    """
+    Feature matrix and label vector of a dataset, as views of its columns where pandas allows it.
+
+    For a frame from preprocessing the features share one column-major block, so neither array is a copy.
+    """
+    return df.loc[:, df.columns != label_col].to_numpy(), df[label_col].to_numpy()
+
+
+###------------------Preprocessing Function (includes Scaling)------------------------
+def encode_dataset(dataset_orig, compact=False):
+    """
+    Filter and encode the raw HMDA columns into one unscaled matrix, the first step of preprocessing.
+
+    Rows whose protected attributes or action_taken have no code in constant.code_maps are dropped, the coded
+    columns are mapped through their categories, every other column is converted to float in place in one
+    preallocated matrix and rows with missing values are dropped.
+
+    :param dataset_orig: Raw DataFrame containing at least column_labels.
+    :param compact: Build a float32 matrix instead of a float64 one.
+    :return: Column-major matrix with column_labels columns, and the sorted loan product types its
+             derived_loan_product_type codes index.
+    """
+
+    # One validity mask over all coded columns
+    encoded = {col: encode_column(dataset_orig[col], codes) for col, codes in code_maps.items()}
+    valid = np.logical_and.reduce([~np.isnan(codes) for codes in encoded.values()])
+    rows = np.flatnonzero(valid)
+
+    # Column-major so each column is filled contiguously and the frame below wraps it without a copy
+    values = np.empty((len(rows), len(column_labels)), dtype=np.float32 if compact else float, order='F')
+    product_types = []
+    for j, col in enumerate(column_labels):
+        if col in encoded:
+            values[:, j] = encoded[col][rows]
+        elif col == 'derived_loan_product_type':
+            # assigns each unique categorical value a unique integer id
+            product_type = dataset_orig[col].iloc[rows].astype('category').cat.remove_unused_categories()
+            values[:, j] = product_type.cat.codes.to_numpy()
+            product_types = list(product_type.cat.categories)
+        else:
+            values[:, j] = np.asarray(dataset_orig[col].to_numpy()[rows], dtype=float)
+
+    complete = ~np.isnan(values).any(axis=1)
+    if not complete.all():
+        values = np.asfortranarray(values[complete])
+    return values, product_types
+
+
+def dataset_frame(values, compact=False):
+    """Wrap a scaled column-major matrix as the preprocessed dataset, without copying it."""
+    df = pd.DataFrame(values, columns=column_labels, copy=False)
+    if compact:
+        # Replacing only the label column splits it off, so the features stay one block sharing the scaled matrix
+        df['action_taken'] = df['action_taken'].astype(np.int8)
+    return df
+
+
+def preprocessing(dataset_orig, compact=False):
+    """
+    Filter, encode and scale the raw HMDA columns in a single pass.
+
+    encode_dataset builds the unscaled matrix and it is min-max scaled in place.
+
+    In compact mode the features are float32 and action_taken is int8, which halves the size of the dataset and of
+    every matrix taken from it. The scaled protected attributes (0, 0.5 and 1) stay features of the model and are
+    exact in float32, so they keep that dtype.
+
+    :param dataset_orig: Raw DataFrame containing at least column_labels.
+    :param compact: Store float32 features and an int8 label instead of float64 throughout.
+    :return: Scaled DataFrame with column_labels columns and a fresh index.
+    """
+
+    values, _ = encode_dataset(dataset_orig, compact)
+
+    ####---------------Scale Dataset---------------
+    values = MinMaxScaler(copy=False).fit_transform(values)
+    return dataset_frame(values, compact)
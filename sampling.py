@@ -1,7 +1,13 @@
 import random
+import logging
+import numpy as np
 import pandas as pd
 from sklearn.neighbors import NearestNeighbors
 from constant import column_labels
+from neighbors import NeighborIndex
+
+logger = logging.getLogger(__name__)
+
 
 def get_neighbors(df, knn):
     """Fetch three samples: a random parent and its two nearest neighbors."""
@@ -53,18 +59,207 @@ def generate_samples(no_of_samples_zeros, no_of_samples_ones, df, df_name):
             count_one += 1
 
     final_df_zero, final_df_one = pd.DataFrame(total_data_zero), pd.DataFrame(total_data_one)
+    rename_columns(df_name, final_df_zero, final_df_one)
+
+    return final_df_zero, final_df_one
+
+
+def rename_columns(df_name, *frames):
+    """Rename the positional columns of generated frames if the dataframe is 'HMDA'."""
 
-    # Rename columns if the dataframe is 'HMDA'
     if df_name == 'HMDA':
         column_array = column_labels
         rename_dict = {c: column_array[c] for c in range(len(column_array))}
-        final_df_zero.rename(columns=rename_dict, errors="raise", inplace=True)
-        final_df_one.rename(columns=rename_dict, errors="raise", inplace=True)
+        for frame in frames:
+            frame.rename(columns=rename_dict, errors="raise", inplace=True)
+
+
+def crossover(parents, child1, child2, rng, cr=0.8, f=0.8):
+    """
+    Apply the generate_samples crossover/mutation to whole batches of rows at once.
+
+    :param parents: DataFrame of parent rows.
+    :param child1: DataFrame of first neighbors, aligned row by row with parents.
+    :param child2: DataFrame of second neighbors, aligned row by row with parents.
+    :param rng: numpy.random.Generator used for the random choices.
+    :param cr: Crossover rate; boolean columns keep the parent value with probability 1 - cr.
+    :param f: Mutation factor for numeric columns.
+    :return: List of new column arrays, in parent column order.
+    """
+
+    columns = []
+    for key in parents.columns:
+        value, first, second = parents[key].to_numpy(), child1[key].to_numpy(), child2[key].to_numpy()
+        if value.dtype == bool:
+            columns.append(np.where(cr < rng.random(len(value)), value, ~value))
+        elif value.dtype == object:
+            choice = rng.integers(0, 3, len(value))
+            columns.append(np.choose(choice, [value, first, second]))
+        else:
+            columns.append(np.abs(value + f * (first - second)))
+    return columns
+
+
+def candidate_labels(labels, knn, f=0.8, max_rows=65536):
+    """
+    Labels crossover can give candidates, worked out from a bounded set of parents.
+
+    A candidate's label depends only on the labels of its parent and of the parent's two nearest neighbors. Every row
+    is checked as a parent when there are at most max_rows; otherwise about max_rows evenly spaced rows are, a third
+    of them among all rows and a third among the rows of each label, so a rare label is not missed.
+
+    :param labels: Numeric labels of the rows.
+    :param knn: NeighborIndex of the rows.
+    :param f: Mutation factor.
+    :param max_rows: Maximum number of parents checked.
+    :return: Candidate label of every checked parent.
+    """
+
+    labels = labels.astype(float)
+    if len(labels) <= max_rows:
+        parents = np.arange(len(labels))
+    else:
+        groups = [np.arange(len(labels)), np.flatnonzero(labels == 0), np.flatnonzero(labels == 1)]
+        parents = np.unique(np.concatenate([group[np.linspace(0, len(group) - 1, min(max_rows // 3, len(group)),
+                                                              dtype=np.intp)] for group in groups if len(group)]))
+    graph = knn.neighbors(parents)
+    return np.abs(labels[parents] + f * (labels[graph[:, min(1, knn.k - 1)]] - labels[graph[:, knn.k - 1]]))
+
+
+def generate_samples_batched(no_of_samples_zeros, no_of_samples_ones, df, df_name, rng=None, cr=0.8, f=0.8,
+                             batch_size=65536, max_batches=1000, knn_cache_dir=None, knn_algorithm='auto'):
+    """
+    Generate synthetic samples using KNN, a whole batch of candidates at a time.
+
+    Produces the same kind of rows as generate_samples: all parents of a batch are drawn in one step, a single
+    kneighbors query fetches their two nearest neighbors, and crossover/mutation run as array operations.
+    Candidates whose label is not exactly 0 or 1, or whose class is already full, are discarded. A class no
+    candidate can land on (see candidate_labels) gets no samples and a warning instead of exhausting max_batches, and
+    a class still short after max_batches keeps the samples found so far, with a warning.
+
+    :param no_of_samples_zeros: Number of samples with class 0.
+    :param no_of_samples_ones: Number of samples with class 1.
+    :param df: DataFrame to generate samples from; the last column is the class label.
+    :param df_name: Name of the dataframe, specific handling for 'HMDA'.
+    :param rng: numpy.random.Generator or seed, for reproducible runs.
+    :param cr: Crossover rate.
+    :param f: Mutation factor.
+    :param batch_size: Maximum number of candidates generated per batch.
+    :param max_batches: Number of batches after which generation gives up.
+    :param knn_cache_dir: Directory of cached neighbor graphs (see neighbors.NeighborIndex), or None.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: DataFrames for class 0 and 1 samples.
+    """
+
+    rng = np.random.default_rng(rng)
+    df = df.reset_index(drop=True)
+    df.columns = range(df.shape[1])
+    # Compact frames (float32 features) search their neighbors in float32
+    data = df.to_numpy(dtype=np.float32 if (df.dtypes == np.float32).any() else float)
+    knn = NeighborIndex(data, 3, algorithm=knn_algorithm, cache_dir=knn_cache_dir)
+    label = df.columns[-1]
+
+    needed = {0: max(no_of_samples_zeros, 0), 1: max(no_of_samples_ones, 0)}
+    accepted = {0: [], 1: []}
+
+    # Labels candidates can have, checked on at most one batch of parents
+    possible = df[label].to_numpy()
+    if (needed[0] or needed[1]) and possible.dtype.kind in 'fiu':
+        possible = candidate_labels(possible, knn, f, batch_size)
+    for value in (0, 1):
+        if needed[value] and not (possible == value).any():
+            logger.warning('No rows can generate samples with label %s; %d samples are missing from the class',
+                           value, needed[value])
+            needed[value] = 0
+
+    for _ in range(max_batches):
+        if not needed[0] and not needed[1]:
+            break
+        n_candidates = min(batch_size, max(2 * (needed[0] + needed[1]), 64))
+        parent_idx = rng.integers(0, df.shape[0], n_candidates)
+        neighbors_indices = knn.neighbors(parent_idx)
+
+        parents = df.iloc[parent_idx]
+        child1 = df.iloc[neighbors_indices[:, min(1, knn.k - 1)]]
+        child2 = df.iloc[neighbors_indices[:, knn.k - 1]]
+        candidates = pd.DataFrame(dict(zip(df.columns, crossover(parents, child1, child2, rng, cr, f))))
+
+        for value in (0, 1):
+            keep = candidates[candidates[label] == value].iloc[:needed[value]]
+            accepted[value].append(keep)
+            needed[value] -= len(keep)
+    else:
+        if needed[0] or needed[1]:
+            logger.warning('Gave up after %d batches; %d samples with label 0 and %d with label 1 are missing',
+                           max_batches, needed[0], needed[1])
+
+    final_df_zero, final_df_one = [pd.concat(accepted[value] or [df.iloc[:0]], ignore_index=True) for value in (0, 1)]
+    rename_columns(df_name, final_df_zero, final_df_one)
 
     return final_df_zero, final_df_one
 
+
+def generate_samples_conditional(no_of_samples_zeros, no_of_samples_ones, df, df_name, rng=None, cr=0.8, f=0.8,
+                                 knn_cache_dir=None, knn_algorithm='auto'):
+    """
+    Generate synthetic samples of each class from that class's rows only.
+
+    Parents and their two nearest neighbors are drawn from the rows whose label is the target class, crossover and
+    mutation apply to the feature columns, and the label is set to the target class. Every candidate is kept, so
+    exactly the requested number of rows is generated. A class with fewer than three rows reuses its nearest rows
+    as neighbors (a single row is copied); a class without rows gets no samples and a warning.
+
+    :param no_of_samples_zeros: Number of samples with class 0.
+    :param no_of_samples_ones: Number of samples with class 1.
+    :param df: DataFrame to generate samples from; the last column is the class label.
+    :param df_name: Name of the dataframe, specific handling for 'HMDA'.
+    :param rng: numpy.random.Generator or seed, for reproducible runs.
+    :param cr: Crossover rate.
+    :param f: Mutation factor.
+    :param knn_cache_dir: Directory of cached neighbor graphs (see neighbors.NeighborIndex), or None.
+    :param knn_algorithm: NearestNeighbors backend: 'auto', 'kd_tree', 'ball_tree' or 'brute'.
+    :return: DataFrames for class 0 and 1 samples.
+    """
+
+    rng = np.random.default_rng(rng)
+    df = df.reset_index(drop=True)
+    df.columns = range(df.shape[1])
+    label = df.columns[-1]
+    features = df.drop(columns=label)
+    # Compact frames (float32 features) search their neighbors in float32
+    data = features.to_numpy(dtype=np.float32 if (features.dtypes == np.float32).any() else float)
+    labels = df[label].to_numpy()
+
+    generated = []
+    for value, n_samples in ((0, max(no_of_samples_zeros, 0)), (1, max(no_of_samples_ones, 0))):
+        rows = np.flatnonzero(labels == value)
+        if n_samples and rows.size == 0:
+            logger.warning('No rows with label %s to generate %d samples from; the class stays short', value,
+                           n_samples)
+        if n_samples == 0 or rows.size == 0:
+            generated.append(df.iloc[:0])
+            continue
+
+        knn = NeighborIndex(data[rows], 3, algorithm=knn_algorithm, cache_dir=knn_cache_dir)
+        k = knn.k
+        parent_idx = rng.integers(0, rows.size, n_samples)
+        neighbors_indices = knn.neighbors(parent_idx)
+
+        parents = features.iloc[rows[parent_idx]]
+        child1 = features.iloc[rows[neighbors_indices[:, min(1, k - 1)]]]
+        child2 = features.iloc[rows[neighbors_indices[:, k - 1]]]
+        samples = pd.DataFrame(dict(zip(features.columns, crossover(parents, child1, child2, rng, cr, f))))
+        samples[label] = np.full(n_samples, value, dtype=labels.dtype)
+        generated.append(samples)
+
+    final_df_zero, final_df_one = generated
+    rename_columns(df_name, final_df_zero, final_df_one)
+
+    return final_df_zero, final_df_one
+
+
 def delete_samples(df: pd.DataFrame, target_column: str, target_value: int,
-                          num_samples_to_delete: int) -> pd.DataFrame:
+                          num_samples_to_delete: int, rng: np.random.Generator = None) -> pd.DataFrame:
     """
     Delete a specified number of samples from a dataframe based on a target value in a specified column.
 
@@ -72,6 +267,7 @@ def delete_samples(df: pd.DataFrame, target_column: str, target_value: int,
     :param target_column: Column to check for target value
     :param target_value: Value to check for deletion
     :param num_samples_to_delete: Number of samples to delete
+    :param rng: Generator used to pick the rows; the global random module if omitted
     :return: Updated dataframe
     """
 
@@ -80,7 +276,10 @@ def delete_samples(df: pd.DataFrame, target_column: str, target_value: int,
     if len(eligible_rows) < num_samples_to_delete:
         raise ValueError("Not enough eligible rows to delete")
 
-    rows_to_delete = random.sample(eligible_rows, num_samples_to_delete)
+    if rng is None:
+        rows_to_delete = random.sample(eligible_rows, num_samples_to_delete)
+    else:
+        rows_to_delete = rng.choice(eligible_rows, num_samples_to_delete, replace=False)
     df = df.drop(rows_to_delete)
     df.reset_index(drop=True, inplace=True)
 
@@ -0,0 +1,239 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Custom Exceptions
+class EmptyList(Exception):
+    pass
+
+
+def _as_matrix(X):
+    """Return the feature matrix as a 2-D float array (float32 stays float32) without copying when possible."""
+    X = np.asarray(X.values if hasattr(X, 'values') else X)
+    return X if X.dtype.kind == 'f' else X.astype(float)
+
+
+def _is_binary_linear(clf):
+    """Check whether a classifier predicts by thresholding a single linear score at zero."""
+    coef = getattr(clf, 'coef_', None)
+    return (coef is not None and hasattr(clf, 'intercept_') and len(getattr(clf, 'classes_', ())) == 2
+            and np.ndim(coef) == 2 and np.shape(coef)[0] == 1)
+
+
+def linear_situation_test(coef, intercept, X, protected_idx, combinations):
+    """
+    Situation-test a binary linear model in closed form.
+
+    The score is linear in the protected columns, so the prediction flips for some combination exactly when the
+    smallest and largest protected contributions land on different sides of the decision threshold.
+
+    :param coef: Coefficient vector (or the 1 x n_features coef_ array of a fitted model).
+    :param intercept: Intercept scalar (or the intercept_ array of a fitted model).
+    :param X: Feature matrix (DataFrame or 2-D array) without the label column.
+    :param protected_idx: Positions of the protected columns in X, in the column order of combinations.
+    :param combinations: Table of protected-value combinations (DataFrame or 2-D array), one per row.
+    :return: Boolean flip mask, per-row flip counts and a mask of rows whose score lies within rounding error of the
+             threshold for some combination (those rows should be confirmed with the model itself).
+    """
+
+    X = _as_matrix(X)
+    combinations = _as_matrix(combinations)
+    protected_idx = list(protected_idx)
+    # float32 data (compact mode) is scored in float32 rather than upcast, with a correspondingly wider tolerance
+    coef = np.asarray(coef, dtype=float).ravel().astype(X.dtype)
+    rel_tol = max(1e-9, 100 * np.finfo(X.dtype).eps)
+    intercept = float(np.ravel(intercept)[0])
+
+    if combinations.shape[0] == 0:
+        raise EmptyList
+
+    protected_coef = coef[protected_idx]
+    contributions = combinations @ protected_coef
+    sorted_contributions = np.sort(contributions)
+
+    # Score of each row with its own protected contribution taken out
+    base = X @ coef + intercept - X[:, protected_idx] @ protected_coef
+
+    n_positive = contributions.size - np.searchsorted(sorted_contributions, -base, side='right')
+    first_positive = base + contributions[0] > 0
+    flip_counts = np.where(first_positive, contributions.size - n_positive, n_positive)
+
+    # Rows whose closest combination score is within rounding error of zero
+    tolerance = rel_tol * (np.abs(X) @ np.abs(coef) + abs(intercept) + np.abs(contributions).max())
+    nearest = np.searchsorted(sorted_contributions, -base)
+    below = sorted_contributions[np.clip(nearest - 1, 0, contributions.size - 1)]
+    above = sorted_contributions[np.clip(nearest, 0, contributions.size - 1)]
+    ambiguous = np.minimum(np.abs(base + below), np.abs(base + above)) <= tolerance
+
+    return flip_counts > 0, flip_counts, ambiguous
+
+
+def situation_test(clf, X, protected_idx, combinations, batch_size=1_000_000, stop_early=True, n_workers=1):
+    """
+    Situation-test every row of a feature matrix in chunked batches.
+
+    Each row is predicted once per combination of protected values, with the combination substituted into the
+    protected columns. A row "flips" when those predictions are not all the same. Binary linear models (anything
+    exposing coef_ and intercept_) take the closed-form path in linear_situation_test; only rows sitting on the
+    decision threshold are re-checked with predict.
+
+    :param clf: Fitted classifier exposing predict.
+    :param X: Feature matrix (DataFrame or 2-D array) without the label column.
+    :param protected_idx: Positions of the protected columns in X, in the column order of combinations.
+    :param combinations: Table of protected-value combinations (DataFrame or 2-D array), one per row.
+    :param batch_size: Maximum number of counterfactual rows handed to a single predict call.
+    :param stop_early: Stop evaluating a row's remaining combinations once a flip is found.
+    :param n_workers: Number of processes sharing the predict path (see parallel_situation_test); the closed-form
+                      linear path always runs in this process.
+    :return: Boolean flip mask and per-row flip counts. A flip count is the number of combinations whose prediction
+             differs from the first combination's; with stop_early it is only a lower bound (0 or at least 1),
+             except on the linear path where it is always exact.
+    """
+
+    X = _as_matrix(X)
+    combinations = _as_matrix(combinations)
+    protected_idx = list(protected_idx)
+
+    if _is_binary_linear(clf):
+        flip_mask, flip_counts, ambiguous = linear_situation_test(clf.coef_, clf.intercept_, X, protected_idx,
+                                                                  combinations)
+        if ambiguous.any():
+            checked_mask, checked_counts = _predict_situation_test(clf, X[ambiguous], protected_idx, combinations,
+                                                                   batch_size, stop_early=False)
+            flip_mask[ambiguous], flip_counts[ambiguous] = checked_mask, checked_counts
+        return flip_mask, flip_counts
+
+    if n_workers > 1:
+        return parallel_situation_test(clf, X, protected_idx, combinations, n_workers, batch_size, stop_early)
+    return _predict_situation_test(clf, X, protected_idx, combinations, batch_size, stop_early)
+
+
+def _predict_situation_test(clf, X, protected_idx, combinations, batch_size, stop_early):
+    """Generic situation test that calls predict on rows x combinations batches."""
+    n_rows, n_combs = X.shape[0], combinations.shape[0]
+
+    if n_combs == 0:
+        raise EmptyList
+
+    flip_counts = np.zeros(n_rows, dtype=np.int64)
+    if n_combs == 1:
+        return flip_counts > 0, flip_counts
+
+    # Combinations are evaluated in blocks so rows that already flipped can be dropped between blocks.
+    comb_block = min(n_combs - 1, max(1, batch_size // max(n_rows, 1))) if stop_early else n_combs - 1
+    chunk_rows = max(1, batch_size // comb_block)
+
+    for start in range(0, n_rows, chunk_rows):
+        chunk = X[start:start + chunk_rows]
+        counts = flip_counts[start:start + chunk_rows]
+
+        reference_X = chunk.copy()
+        reference_X[:, protected_idx] = combinations[0]
+        reference = clf.predict(reference_X)
+
+        active = np.arange(chunk.shape[0])
+        for comb_start in range(1, n_combs, comb_block):
+            if stop_early and active.size == 0:
+                break
+            block = combinations[comb_start:comb_start + comb_block]
+
+            # Rows x combinations counterfactual batch, row-major so predictions reshape to (rows, block)
+            batch = np.repeat(chunk[active], block.shape[0], axis=0)
+            batch[:, protected_idx] = np.tile(block, (active.size, 1))
+            preds = clf.predict(batch).reshape(active.size, block.shape[0])
+
+            counts[active] += (preds != reference[active, None]).sum(axis=1)
+            if stop_early:
+                active = active[counts[active] == 0]
+
+    return flip_counts > 0, flip_counts
+
+
+def _substitution_situation_test(clf, X, protected_idx, combinations, chunk_rows, stop_early):
+    """
+    Situation test that reuses one buffer per chunk, overwriting its protected columns for each combination.
+
+    X is only read, so it can be a view of a buffer shared with other processes.
+
+    :return: Per-row flip counts.
+    """
+    flip_counts = np.zeros(X.shape[0], dtype=np.min_scalar_type(combinations.shape[0]))
+
+    for start in range(0, X.shape[0], chunk_rows):
+        buffer = np.array(X[start:start + chunk_rows])
+        counts = flip_counts[start:start + chunk_rows]
+
+        buffer[:, protected_idx] = combinations[0]
+        reference = clf.predict(buffer)
+        active = np.arange(buffer.shape[0])
+
+        for combination in combinations[1:]:
+            if stop_early and active.size == 0:
+                break
+            buffer[:, protected_idx] = combination
+            counts[active] += clf.predict(buffer) != reference[active]
+            if stop_early:
+                # Only rows that have not flipped yet stay in the buffer
+                still = counts[active] == 0
+                active, buffer = active[still], buffer[still]
+
+    return flip_counts
+
+
+# Per-process state of the parallel_situation_test workers, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(path, clf, protected_idx, combinations, chunk_rows, stop_early):
+    _worker.update(X=np.load(path, mmap_mode='r'), clf=clf, protected_idx=protected_idx, combinations=combinations,
+                   chunk_rows=chunk_rows, stop_early=stop_early)
+
+
+def _test_rows(start, stop):
+    return _substitution_situation_test(_worker['clf'], _worker['X'][start:stop], _worker['protected_idx'],
+                                        _worker['combinations'], _worker['chunk_rows'], _worker['stop_early'])
+
+
+def parallel_situation_test(clf, X, protected_idx, combinations, n_workers, batch_size=1_000_000, stop_early=True):
+    """
+    Situation-test with the predict path spread over worker processes.
+
+    The feature matrix is written once to a memory-mapped file that every worker maps read-only, so workers get
+    their row ranges as zero-copy views instead of pickled copies; the model and the combinations are sent once
+    per worker. Each worker substitutes the combinations into the protected columns of one chunk buffer in place
+    and returns only the flip counts of its rows, one byte per row for up to 255 combinations.
+
+    :param clf: Fitted classifier exposing predict.
+    :param X: Feature matrix (DataFrame or 2-D array) without the label column.
+    :param protected_idx: Positions of the protected columns in X, in the column order of combinations.
+    :param combinations: Table of protected-value combinations (DataFrame or 2-D array), one per row.
+    :param n_workers: Number of worker processes.
+    :param batch_size: Maximum number of counterfactual rows a worker predicts per chunk of combinations.
+    :param stop_early: Stop evaluating a row's remaining combinations once a flip is found.
+    :return: Boolean flip mask and per-row flip counts, as situation_test.
+    """
+
+    X = _as_matrix(X)
+    combinations = _as_matrix(combinations)
+    protected_idx = list(protected_idx)
+
+    if combinations.shape[0] == 0:
+        raise EmptyList
+
+    n_rows = X.shape[0]
+    chunk_rows = max(1, batch_size // combinations.shape[0])
+    # A few ranges per worker, so uneven early stopping does not leave workers idle
+    bounds = np.linspace(0, n_rows, min(n_rows, 4 * n_workers) + 1).astype(int)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'X.npy')
+        np.save(path, X)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(path, clf, protected_idx, combinations, chunk_rows, stop_early)) as executor:
+            counts = list(executor.map(_test_rows, bounds[:-1], bounds[1:]))
+
+    flip_counts = np.concatenate(counts).astype(np.int64) if counts else np.zeros(0, dtype=np.int64)
+    return flip_counts > 0, flip_counts
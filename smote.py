@@ -1,11 +1,10 @@
-import random
-from collections import Counter
+import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
+from neighbors import NeighborIndex
 
 
 class SMOTE:
-    def __init__(self, data, neighbor=5, r=2, up_to_num=None):
+    def __init__(self, data, neighbor=5, r=2, up_to_num=None, rng=None, knn_cache_dir=None, knn_algorithm='auto'):
         """
         Initialize SMOTE instance.
 
@@ -13,46 +12,68 @@ class SMOTE:
         :param neighbor: int - number of nearest neighbors to select
         :param r: int - distance metric
         :param up_to_num: int - size of minorities to over-sample
+        :param rng: numpy.random.Generator or seed - source of randomness
+        :param knn_cache_dir: str - directory of cached neighbor graphs (see neighbors.NeighborIndex), or None
+        :param knn_algorithm: str - NearestNeighbors backend ('auto', 'kd_tree', 'ball_tree' or 'brute')
         """
         self.data = data
         self.neighbor = neighbor
         self.r = r
+        self.rng = np.random.default_rng(rng)
+        self.knn_cache_dir = knn_cache_dir
+        self.knn_algorithm = knn_algorithm
         self.up_to_num = up_to_num or self.get_majority_num()
 
+    def _label_counts(self):
+        """Get the labels and their counts, in order of first appearance."""
+        labels = self.data.iloc[:, -1].to_numpy()
+        unique_labels, first_idx, counts = np.unique(labels, return_index=True, return_counts=True)
+        order = np.argsort(first_idx)
+        return labels, unique_labels[order], counts[order]
+
     def get_majority_num(self):
         """Get the number of majority class instances."""
-        label_counts = Counter(self.data.iloc[:, -1].values)
-        return max(label_counts.values())
+        _, _, counts = self._label_counts()
+        return counts.max()
 
-    def _get_neighbor(self, data_no_label):
-        """Get a random neighbor of a random sample from the data."""
-        rand_sample_idx = random.randint(0, len(data_no_label) - 1)
-        rand_sample = data_no_label[rand_sample_idx]
+    def _get_neighbors(self, data_no_label, num):
+        """Get a random neighbor of each of num random samples, from one index and one bulk query."""
+        # A label with fewer rows than neighbor draws from all of them
+        knn = NeighborIndex(data_no_label, self.neighbor, p=self.r, algorithm=self.knn_algorithm,
+                            cache_dir=self.knn_cache_dir)
 
-        knn = NearestNeighbors(n_neighbors=self.neighbor, p=self.r).fit(data_no_label)
-        _, neighbors = knn.kneighbors(rand_sample.reshape(1, -1))
-        rand_neighbor = data_no_label[random.choice(neighbors[0])]
+        rand_samples_idx = self.rng.integers(0, len(data_no_label), num)
+        neighbors = knn.neighbors(rand_samples_idx)
+        rand_neighbors_idx = neighbors[np.arange(num), self.rng.integers(0, neighbors.shape[1], num)]
 
-        return rand_neighbor, rand_sample
+        return data_no_label[rand_neighbors_idx], data_no_label[rand_samples_idx]
 
     def run(self):
         """Perform SMOTE."""
-        total_data = self.data.values.tolist()
-        label_counts = Counter(self.data.iloc[:, -1].values)
-        majority_num = max(label_counts.values())
+        labels, unique_labels, counts = self._label_counts()
+        # Compact frames keep their float32 features
+        dtype = np.float32 if (self.data.dtypes == np.float32).any() else float
+        features = self.data.iloc[:, :-1].to_numpy(dtype=dtype)
+        majority_num = counts.max()
 
-        for label, num in label_counts.items():
-            if num < majority_num:
-                to_add = self.up_to_num - num
+        to_add = [(label, max(self.up_to_num - num, 0)) for label, num in zip(unique_labels, counts)
+                  if num < majority_num]
 
-                data_with_label = self.data[self.data.iloc[:, -1] == label]
-                data_no_label = data_with_label.iloc[:, :-1].values
+        n_rows = len(features) + sum(num for _, num in to_add)
+        total_features = np.empty((n_rows, features.shape[1]), dtype=features.dtype)
+        total_labels = np.empty(n_rows, dtype=labels.dtype)
+        total_features[:len(features)], total_labels[:len(features)] = features, labels
 
-                for _ in range(to_add):
-                    rand_neighbor, sample = self._get_neighbor(data_no_label)
-                    new_row = [max(0, sample[i] + (sample[i] - one) * random.random()) for i, one in
-                               enumerate(rand_neighbor)]
-                    new_row.append(label)
-                    total_data.append(new_row)
+        start = len(features)
+        for label, num in to_add:
+            if num == 0:
+                continue
+            rand_neighbors, samples = self._get_neighbors(features[labels == label], num)
+            new_rows = total_features[start:start + num]
+            np.maximum(0, samples + (samples - rand_neighbors) * self.rng.random(samples.shape), out=new_rows)
+            total_labels[start:start + num] = label
+            start += num
 
-        return pd.DataFrame(total_data)
+        total_data = pd.DataFrame(total_features)
+        total_data[features.shape[1]] = total_labels
+        return total_data
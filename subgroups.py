@@ -0,0 +1,68 @@
+from statistics import median
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+
+def get_unique_df(processed_scaled_df, ind_cols):
+    uniques = [processed_scaled_df[i].unique().tolist() for i in ind_cols]
+    unique_df = pd.DataFrame(product(*uniques), columns=ind_cols)
+    return unique_df
+
+
+def split_dataset(processed_scaled_df, ind_cols):
+    return list(SubgroupIndex(processed_scaled_df, ind_cols))
+
+
+class SubgroupIndex:
+    def __init__(self, df, ind_cols, label_col='action_taken'):
+        """
+        Index the intersectional subgroups of a dataset in one pass.
+
+        Subgroups are numbered in the row order of unique_df (every combination of the protected values), so
+        subgroup i holds the rows matching unique_df.iloc[i], in their original order.
+
+        :param df: DataFrame to partition.
+        :param ind_cols: Protected columns defining the subgroups.
+        :param label_col: Binary label column whose counts are cached per subgroup.
+        """
+        self.df = df
+        self.ind_cols = ind_cols
+        self.label_col = label_col
+        self.unique_df = get_unique_df(df, ind_cols)
+
+        uniques = [pd.Index(df[col].unique()) for col in ind_cols]
+        codes = [index.get_indexer(df[col]) for index, col in zip(uniques, ind_cols)]
+        group_id = np.ravel_multi_index(codes, [len(index) for index in uniques])
+
+        # Row positions grouped by subgroup; the stable sort keeps each subgroup in original row order
+        self.order = np.argsort(group_id, kind='stable')
+        self.bounds = np.searchsorted(group_id[self.order], np.arange(len(self.unique_df) + 1))
+
+        labels = df[label_col].to_numpy()
+        self.pos_counts = np.bincount(group_id, weights=labels == 1, minlength=len(self.unique_df)).astype(int)
+        self.neg_counts = np.bincount(group_id, weights=labels == 0, minlength=len(self.unique_df)).astype(int)
+
+    def __len__(self):
+        return len(self.unique_df)
+
+    def positions(self, i):
+        """Row positions of subgroup i, as a view into the index."""
+        return self.order[self.bounds[i]:self.bounds[i + 1]]
+
+    def __getitem__(self, i):
+        """Rows of subgroup i as a new frame with a fresh index, like an inner merge on unique_df.iloc[[i]]."""
+        return self.df.iloc[self.positions(i)].reset_index(drop=True)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def label_counts(self, i):
+        """Cached (positive, negative) label counts of subgroup i."""
+        return int(self.pos_counts[i]), int(self.neg_counts[i])
+
+    def median_target(self):
+        """Median of all per-subgroup positive and negative counts, the balancing target of get_median_val."""
+        array_of_bars = np.column_stack([self.pos_counts, self.neg_counts]).ravel().tolist()
+        return round(median(array_of_bars))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from constant import column_labels
+
+# Raw values of the protected attributes and their shares, skewed like the national HMDA files. The last value of
+# each is one that preprocessing drops.
+sex_values = (['Male', 'Female', 'Joint', 'Sex Not Available'], [0.45, 0.25, 0.22, 0.08])
+race_values = (['White', 'Black or African American', 'Joint', 'Asian', 'Race Not Available'],
+               [0.72, 0.08, 0.02, 0.06, 0.12])
+ethnicity_values = (['Not Hispanic or Latino', 'Hispanic or Latino', 'Joint', 'Ethnicity Not Available'],
+                    [0.76, 0.09, 0.02, 0.13])
+loan_product_values = (['Conventional:First Lien', 'FHA:First Lien', 'VA:First Lien', 'FSA/RHS:First Lien',
+                        'Conventional:Subordinate Lien', 'FHA:Subordinate Lien', 'VA:Subordinate Lien',
+                        'FSA/RHS:Subordinate Lien'],
+                       [0.62, 0.14, 0.09, 0.02, 0.11, 0.005, 0.01, 0.005])
+
+# Continuous columns and the (log-mean, log-sd) of their log-normal distribution
+continuous_columns = {'loan_amount': (12.2, 0.7), 'tract_population': (8.5, 0.4),
+                      'tract_minority_population_percent': (3.2, 0.8),
+                      'ffiec_msa_md_median_family_income': (11.2, 0.2), 'tract_to_msa_income_percentage': (4.6, 0.3),
+                      'tract_owner_occupied_units': (7.0, 0.5), 'tract_one_to_four_family_homes': (7.3, 0.5),
+                      'tract_median_age_of_housing_units': (3.5, 0.5), 'derived_msa-md': (10.2, 0.4)}
+
+
+def make_synthetic_hmda(n_rows, seed=0):
+    """
+    Generate raw HMDA-shaped data with the constant.column_labels schema.
+
+    The protected attributes follow skewed marginals, so the 27 kept (ethnicity, race, sex) combinations range from
+    large to a handful of rows, and approval rates differ between subgroups. Coded columns draw small integer codes
+    and the remaining columns are log-normal, all as they appear in the raw files before preprocessing.
+
+    :param n_rows: Number of rows.
+    :param seed: Seed of the generator.
+    :return: Raw DataFrame whose string columns have object dtype.
+    """
+
+    rng = np.random.default_rng(seed)
+    data = {}
+
+    for col in column_labels:
+        if col in continuous_columns:
+            mean, sd = continuous_columns[col]
+            data[col] = np.round(rng.lognormal(mean, sd, n_rows))
+        else:
+            data[col] = rng.integers(1, 6, n_rows).astype(float)
+
+    for col, (values, shares) in [('derived_sex', sex_values), ('derived_race', race_values),
+                                  ('derived_ethnicity', ethnicity_values),
+                                  ('derived_loan_product_type', loan_product_values)]:
+        data[col] = np.array(values, dtype=object)[rng.choice(len(values), n_rows, p=shares)]
+
+    # Approval odds shift with the subgroup and the loan size
+    score = (1.2 + 0.6 * (data['derived_race'] == 'White') - 0.4 * (data['derived_ethnicity'] == 'Hispanic or Latino')
+             + 0.2 * (data['derived_sex'] == 'Joint') - 0.3 * (np.log(data['loan_amount']) - 12.2)
+             + rng.normal(0, 1, n_rows))
+    approved = score > 0.8
+    outcome = np.where(approved, rng.choice(['1', '2'], n_rows, p=[0.93, 0.07]),
+                       rng.choice(['3', '4', '5', '6', '7', '8'], n_rows, p=[0.7, 0.1, 0.1, 0.04, 0.03, 0.03]))
+    data['action_taken'] = outcome.astype(object)
+
+    return pd.DataFrame(data, columns=column_labels)